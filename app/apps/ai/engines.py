@@ -1,12 +1,67 @@
+import asyncio
+import importlib.util
+import json
+import logging
 import os
 
+import httpx
+from fastapi_mongo_base.core import exceptions
 from singleton import Singleton
 
+from server.config import Settings
 
-class AIEngine(metaclass=Singleton):
-    def __init__(self, api_key: str, base_url: str):
+from . import router
+from .limits import EngineLimiter
+from .retries import CircuitBreaker, RetryPolicy
+from .tokens import Tokenizer, get_tokenizer
+
+# catalog fields that need a new client when they change
+CONNECTION_FIELDS = ("kind", "api_key_env", "base_url", "max_connections")
+IMAGE_DEFAULTS = {"max_size_kb": None, "format": "JPEG", "quality": 85}
+
+
+class AIEngine:
+    def __init__(
+        self,
+        model: str,
+        api_key: str,
+        base_url: str,
+        max_connections: int = None,
+        config: dict = None,
+    ):
+        self.model = model
         self.api_key = api_key
         self.base_url = base_url
+        self.max_connections = max_connections or Settings.AI_MAX_CONNECTIONS
+        self._client = None
+        self._limiter = None
+        self._retry_policy = None
+        self._breaker = None
+        self.configure(config or {})
+
+    @classmethod
+    def from_config(cls, model: str, config: dict) -> "AIEngine":
+        engine_class = GeminiEngine if config.get("kind") == "gemini" else AIEngine
+        return engine_class(
+            model,
+            os.getenv(config.get("api_key_env", "METIS_API_KEY")),
+            config["base_url"].format(METIS_URL=Settings.METIS_URL),
+            max_connections=config.get("max_connections"),
+            config=config,
+        )
+
+    def configure(self, config: dict):
+        """Apply prices, limits and retries of a catalog entry to the live engine."""
+
+        self.config = config
+        self.input_price = config.get("input_price", 0.27)
+        self.output_price = config.get("output_price", 1.5)
+        self.image_price = config.get("image_price", 85 * 1.5 / 1000)
+        if self._limiter is not None:
+            limiter = EngineLimiter.from_settings(self.name, config.get("limits"))
+            limiter.latency = self._limiter.latency
+            self._limiter = limiter
+        self._retry_policy = None
 
     def get_dict(self):
         return {
@@ -14,238 +69,292 @@ class AIEngine(metaclass=Singleton):
             "base_url": self.base_url,
         }
 
-    @property
-    def image_price(self):
-        return 85 * 1.5 / 1000
-
-    @property
-    def input_price(self):
-        return 0.27
-
-    @property
-    def output_price(self):
-        return 1.5
-
-    @property
-    def price(self):
-        return self.input_price, self.output_price
-
-    def get_price(self, input_tokens: int, output_tokens: int, image_count: int = 0):
-        return (
-            input_tokens * self.input_price / 1000
-            + output_tokens * self.output_price / 1000
-            + image_count * self.image_price
-        )
-
-    @classmethod
-    def get_by_name(cls, model_name: str) -> "AIEngine":
+    def get_http_options(self) -> dict:
         return {
-            "gpt-4o": MetisGpt4o(),
-            "gpt-4o-mini": MetisGpt4oMini(),
-            "o3-mini": MetisO3mini(),
-            "gemini-1.5-flash": GeminiFlash(),
-            "gemini-1.5-flash-8b": GeminiFlash8(),
-            "gemini-2.0-flash": GeminiFlash2(),
-            "sonar": Perplexity(),
-        }.get(model_name)
-
-
-class Perplexity(AIEngine):
-    def __init__(self):
-        super().__init__(os.getenv("PERPLEXITY_API_KEY"), "https://api.perplexity.ai")
-
-    @property
-    def model(self):
-        return [
-            "sonar-pro",
-            "sonar",
-            "llama-3.1-sonar-huge-128k-online",
-            "llama-3.1-sonar-large-128k-online",
-            "llama-3.1-sonar-small-128k-online",
-        ][1]
-
-    @property
-    def input_price(self):
-        return 0.1
-
-    @property
-    def output_price(self):
-        return 0.1
-
-
-class MetisGpt4o(AIEngine):
-    def __init__(self):
-        super().__init__(os.getenv("METIS_API_KEY"), "https://api.metisai.ir/openai/v1")
-
-    @property
-    def model(self):
-        return "gpt-4o"
-
-    @property
-    def image_price(self):
-        return 85 * 1.5 / 1000
-
-    @property
-    def input_price(self):
-        return 0.275
-
-    @property
-    def output_price(self):
-        return 1.5
-
-
-class MetisGpt4oMini(AIEngine):
-    def __init__(self):
-        super().__init__(os.getenv("METIS_API_KEY"), "https://api.metisai.ir/openai/v1")
-
-    @property
-    def model(self):
-        return "gpt-4o-mini"
-
-    @property
-    def input_price(self):
-        return 0.017
+            "limits": httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+                keepalive_expiry=Settings.AI_KEEPALIVE_EXPIRY,
+            ),
+            "http2": Settings.AI_HTTP2 and importlib.util.find_spec("h2") is not None,
+        }
 
-    @property
-    def output_price(self):
-        return 0.066
+    def create_client(self):
+        import openai
+
+        return openai.AsyncOpenAI(
+            **self.get_dict(),
+            # RetryPolicy is the only retry layer
+            max_retries=0,
+            timeout=openai.Timeout(
+                Settings.AI_TIMEOUT, connect=Settings.AI_CONNECT_TIMEOUT
+            ),
+            http_client=openai.DefaultAsyncHttpxClient(**self.get_http_options()),
+        )
 
     @property
-    def image_price(self):
-        return 85 * 1.5 / 1000
-
+    def client(self):
+        if self._client is None:
+            self._client = self.create_client()
+        return self._client
 
-class MetisO3mini(AIEngine):
-    def __init__(self):
-        super().__init__(os.getenv("METIS_API_KEY"), "https://api.metisai.ir/openai/v1")
+    async def close(self):
+        if self._client is None:
+            return
+        client, self._client = self._client, None
+        await client.close()
 
     @property
-    def model(self):
-        return "o3-mini"
+    def name(self) -> str:
+        return self.model
 
     @property
-    def image_price(self):
-        return 85 * 1.5 / 1000
+    def limiter(self) -> EngineLimiter:
+        if self._limiter is None:
+            self._limiter = EngineLimiter.from_settings(
+                self.name, self.config.get("limits")
+            )
+        return self._limiter
 
     @property
-    def input_price(self):
-        return 0.121
+    def retry_policy(self) -> RetryPolicy:
+        if self._retry_policy is None:
+            self._retry_policy = RetryPolicy.from_settings(
+                self.name, self.config.get("retries")
+            )
+        return self._retry_policy
 
     @property
-    def output_price(self):
-        return 0.484
-
-
-class AvvalAI(AIEngine):
-    def __init__(self):
-        super().__init__(os.getenv("AVVALAI_API_KEY"), "https://api.avalai.ir/v1")
+    def breaker(self) -> CircuitBreaker:
+        if self._breaker is None:
+            self._breaker = CircuitBreaker(self.name)
+        return self._breaker
 
     @property
-    def input_price(self):
-        return 0.3
+    def tokenizer(self) -> Tokenizer:
+        return get_tokenizer(self.config.get("tokenizer") or self.name)
 
     @property
-    def output_price(self):
-        return 1.5
-
-
-class Grok(AIEngine):
-    def __init__(self):
-        # super().__init__(os.getenv("GROK_API_KEY"), "https://api.x.ai/v1")
-        super().__init__(os.getenv("METIS_API_KEY"), "https://api.metisai.ir/openai/v1")
+    def context_window(self) -> int:
+        return self.config.get("context_window", 128000)
 
     @property
-    def model(self):
-        return "grok-2"
+    def structured_output(self) -> bool:
+        """Whether the provider enforces a JSON schema on the answer."""
 
-    @property
-    def input_price(self):
-        return 0.22
+        return self.config.get("structured_output", False)
 
-    @property
-    def output_price(self):
-        return 1.1
+    def input_budget(self, output_tokens: int = None) -> int:
+        output_tokens = output_tokens or Settings.AI_OUTPUT_TOKENS_ESTIMATE
+        budget = self.context_window - output_tokens
+        if Settings.AI_MAX_INPUT_TOKENS:
+            budget = min(budget, Settings.AI_MAX_INPUT_TOKENS)
+        return budget
 
+    def truncate(self, system: str, user: str, output_tokens: int = None) -> str:
+        """Cut `user` so that the system and user prompts fit the input budget."""
 
-class GeminiFlash(AIEngine):
-    def __init__(self):
-        super().__init__(os.getenv("METIS_API_KEY"), "https://api.metisai.ir/openai/v1")
+        budget = self.input_budget(output_tokens) - self.tokenizer.count(system)
+        return self.tokenizer.truncate(user, budget)
 
-    @property
-    def model(self):
-        return "gemini-1.5-flash"
+    def estimate_price(
+        self,
+        system: str,
+        user: str,
+        image_count: int = 0,
+        output_tokens: int = None,
+    ) -> float:
+        input_tokens = self.tokenizer.count(system) + self.tokenizer.count(user)
+        output_tokens = output_tokens or Settings.AI_OUTPUT_TOKENS_ESTIMATE
+        return self.get_price(input_tokens, output_tokens, image_count=image_count)
 
-    @property
-    def input_price(self):
-        return 0.008
+    def image_params(self, low_res: bool = True) -> dict:
+        """Size and encoding of images for this engine and detail level."""
 
-    @property
-    def output_price(self):
-        return 0.033
+        if low_res:
+            # low detail images are seen as a single 512px thumbnail
+            params = {"max_side": 512}
+        else:
+            params = {"max_side": 2048, "short_side": 768, "tile": 512}
+        overrides = self.config.get("image", {}).get("low" if low_res else "high", {})
+        return IMAGE_DEFAULTS | params | overrides
 
     @property
-    def image_price(self):
-        return 0.00004
+    def price(self):
+        return self.input_price, self.output_price
 
+    def get_price(self, input_tokens: int, output_tokens: int, image_count: int = 0):
+        return (
+            input_tokens * self.input_price / 1000
+            + output_tokens * self.output_price / 1000
+            + image_count * self.image_price
+        )
 
-class GeminiFlash8(AIEngine):
-    def __init__(self):
-        super().__init__(os.getenv("METIS_API_KEY"), "https://api.metisai.ir/openai/v1")
+    @classmethod
+    def get_by_name(cls, model_name: str) -> "AIEngine":
+        return EngineCatalog().get(model_name)
 
-    @property
-    def model(self):
-        return "gemini-1.5-flash"
+    @classmethod
+    def engines(cls) -> list["AIEngine"]:
+        return list(EngineCatalog().engines.values())
 
-    @property
-    def input_price(self):
-        return 0.004
+    @classmethod
+    async def init_clients(cls):
+        for engine in cls.engines():
+            if not engine.api_key:
+                logging.warning(f"No api key for {engine.name}")
+                continue
+            engine.client
 
-    @property
-    def output_price(self):
-        return 0.017
+    @classmethod
+    async def close_clients(cls):
+        for engine in cls.engines():
+            await engine.close()
 
-    @property
-    def image_price(self):
-        return 0.00004
 
+class GeminiEngine(AIEngine):
+    def create_client(self):
+        from google import genai
+        from google.genai import types
 
-class GeminiPro(AIEngine):
-    def __init__(self):
-        super().__init__(os.getenv("METIS_API_KEY"), "https://api.metisai.ir/openai/v1")
+        timeout = httpx.Timeout(
+            Settings.AI_TIMEOUT, connect=Settings.AI_CONNECT_TIMEOUT
+        )
+        http_options = types.HttpOptions(
+            base_url=self.base_url,
+            async_client_args=self.get_http_options() | {"timeout": timeout},
+        )
+        return genai.Client(api_key=self.api_key, http_options=http_options)
 
-    @property
-    def model(self):
-        return "gemini-1.5-pro"
+    async def close(self):
+        if self._client is None:
+            return
+        client, self._client = self._client, None
+        await client.aio.aclose()
 
-    @property
-    def input_price(self):
-        return 0.385
+    def image_params(self, low_res: bool = True) -> dict:
+        # 768px keeps an image within one Gemini tile
+        return IMAGE_DEFAULTS | {"max_side": 768} | self.config.get("image", {})
 
-    @property
-    def output_price(self):
-        return 1.155
 
-    @property
-    def image_price(self):
-        return 0.0006575
+class EngineCatalog(metaclass=Singleton):
+    """
+    Engines with their prices, limits and routes, read from AI_ENGINES_PATH.
 
+    The file is polled for changes. Price, limit and retry changes are applied
+    to the live engines; connection changes swap in a new engine and close the
+    old client once its in-flight calls had time to finish.
+    """
 
-class GeminiFlash2(AIEngine):
     def __init__(self):
-        super().__init__(os.getenv("METIS_API_KEY"), "https://api.metisai.ir/openai/v1")
-
-    @property
-    def model(self):
-        return "gemini-2.0-flash"
-
-    @property
-    def input_price(self):
-        return 0.011
-
-    @property
-    def output_price(self):
-        return 0.044
-
-    @property
-    def image_price(self):
-        return 0.00004
+        self._engines: dict[str, AIEngine] | None = None
+        self.routes: dict[str, dict] = {}
+        self.mtime: float | None = None
+        self.watch_task: asyncio.Task | None = None
+        self.retiring: dict[asyncio.Task, AIEngine] = {}
+
+    @property
+    def engines(self) -> dict[str, AIEngine]:
+        if self._engines is None:
+            self.reload()
+        return self._engines
+
+    def load(self) -> dict:
+        path = Settings.AI_ENGINES_PATH
+        self.mtime = path.stat().st_mtime
+        with open(path) as f:
+            return json.load(f)
+
+    def reload(self) -> bool:
+        try:
+            catalog = self.load()
+        except (OSError, ValueError) as e:
+            if self._engines is None:
+                raise
+            logging.warning(f"Could not reload engine catalog, keeping current: {e}")
+            return False
+
+        current = self._engines or {}
+        engines = {}
+        for model, config in catalog.get("engines", {}).items():
+            engine = current.get(model)
+            if engine and all(
+                engine.config.get(f) == config.get(f) for f in CONNECTION_FIELDS
+            ):
+                engine.configure(config)
+            else:
+                engine = AIEngine.from_config(model, config)
+            engines[model] = engine
+
+        for model, engine in current.items():
+            if engines.get(model) is not engine:
+                self.retire(engine)
+        self._engines = engines
+        self.routes = catalog.get("routes", {})
+        return True
+
+    def retire(self, engine: AIEngine):
+        if engine._client is None:
+            return
+
+        async def close_later():
+            await asyncio.sleep(Settings.AI_TIMEOUT)
+            await engine.close()
+
+        task = asyncio.create_task(close_later())
+        self.retiring[task] = engine
+        task.add_done_callback(lambda task: self.retiring.pop(task, None))
+
+    def get(self, model_name: str) -> AIEngine:
+        engine = self.engines.get(model_name)
+        if engine is None:
+            raise exceptions.BaseHTTPException(
+                status_code=400,
+                error="unknown_model",
+                message=f"Model {model_name} is not in the engine catalog",
+            )
+        return engine
+
+    def route(self, key: str, model_name: str) -> list[str]:
+        """Candidate models for a prompt key, best first."""
+
+        policy = self.routes.get(key)
+        if not policy:
+            return [model_name]
+
+        candidates = [
+            self.engines[model]
+            for model in policy.get("models", [model_name])
+            if model in self.engines
+        ]
+        available = [
+            engine
+            for engine in candidates
+            if engine.api_key and engine.breaker.state != "open"
+        ]
+        if not available:
+            return [engine.name for engine in candidates] or [model_name]
+        return [engine.name for engine in router.rank(available, policy)]
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(Settings.AI_ENGINES_RELOAD_INTERVAL)
+            try:
+                if Settings.AI_ENGINES_PATH.stat().st_mtime != self.mtime:
+                    if self.reload():
+                        logging.info("Reloaded engine catalog")
+            except OSError as e:
+                logging.warning(f"Could not check engine catalog: {e}")
+
+    def start(self):
+        self.engines
+        if self.watch_task is None:
+            self.watch_task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self.watch_task:
+            self.watch_task.cancel()
+            self.watch_task = None
+        for task, engine in list(self.retiring.items()):
+            task.cancel()
+            await engine.close()
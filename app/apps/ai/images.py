@@ -0,0 +1,402 @@
+import asyncio
+import base64
+import functools
+import importlib.util
+import logging
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import (
+    BrokenExecutor,
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from io import BytesIO
+from typing import Literal
+
+import httpx
+from fastapi_mongo_base.core import exceptions
+from fastapi_mongo_base.utils import imagetools
+from PIL import Image
+from singleton import Singleton
+
+from server.config import Settings
+from utils.cache import TieredCache, content_hash
+from utils.timing import stage
+
+from . import metrics
+from .memory import MemoryBudget
+
+image_cache = TieredCache(
+    Settings.IMAGE_CACHE_MAX_BYTES,
+    Settings.IMAGE_CACHE_DIR,
+    Settings.IMAGE_CACHE_DISK_MAX_BYTES,
+)
+
+
+def fit_size(
+    width: int,
+    height: int,
+    max_side: int | None = None,
+    short_side: int | None = None,
+    tile: int | None = None,
+    min_tile_scale: float = 0.85,
+) -> tuple[int, int]:
+    """
+    Scale (never up) to fit `max_side` and `short_side`. With `tile`, shrink a
+    little more when losing at most 1 - `min_tile_scale` of the resolution
+    saves a whole row or column of tiles.
+    """
+
+    scale = 1.0
+    if max_side:
+        scale = min(scale, max_side / max(width, height))
+    if short_side:
+        scale = min(scale, short_side / min(width, height))
+
+    if tile:
+        tile_scales = [
+            (math.ceil(side / tile) - 1) * tile / side
+            for side in (width * scale, height * scale)
+            if side > tile
+        ]
+        tile_scales = [s for s in tile_scales if s >= min_tile_scale]
+        if tile_scales:
+            scale *= max(tile_scales)
+
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def encode_image(
+    image: Image.Image,
+    max_size_kb: int | None = 100,
+    *,
+    format: Literal["JPEG", "PNG", "WEBP"] = "JPEG",
+    quality: int | None = None,
+    max_side: int | None = None,
+    short_side: int | None = None,
+    tile: int | None = None,
+) -> bytes:
+    image = imagetools.strip_metadata(image)
+    size = fit_size(*image.size, max_side=max_side, short_side=short_side, tile=tile)
+    if size != image.size:
+        image = image.resize(size, Image.Resampling.LANCZOS)
+    if max_size_kb is not None:
+        image = imagetools.compress_image(image, max_size_kb)
+    return imagetools.convert_image_bytes(image, format, quality).getvalue()
+
+
+def open_image(
+    content: bytes,
+    max_side: int | None = None,
+    short_side: int | None = None,
+    tile: int | None = None,
+) -> Image.Image:
+    """Open lazily, letting JPEGs decode straight at a reduced scale."""
+
+    image = Image.open(BytesIO(content))
+    if image.format == "JPEG":
+        size = fit_size(
+            *image.size, max_side=max_side, short_side=short_side, tile=tile
+        )
+        image.draft(image.mode, size)
+    return image
+
+
+def decoded_bytes(content: bytes, **size) -> int:
+    """Peak memory of encoding `content`: the download, its bitmap and one copy."""
+
+    params = {k: size.get(k) for k in ("max_side", "short_side", "tile")}
+    image = open_image(content, **params)
+    width, height = image.size
+    return len(content) + 2 * width * height * len(image.getbands())
+
+
+def encode_image_bytes(content: bytes, *args, **kwargs) -> bytes:
+    params = {k: kwargs.get(k) for k in ("max_side", "short_side", "tile")}
+    return encode_image(open_image(content, **params), *args, **kwargs)
+
+
+def mime_type(format: str) -> str:
+    return f"image/{format.lower()}"
+
+
+def data_url(content: bytes, mime_type: str = "image/jpeg") -> str:
+    return f"data:{mime_type};base64,{base64.b64encode(content).decode()}"
+
+
+class ImagePool(metaclass=Singleton):
+    """
+    Runs Pillow work off the event loop in a process (or thread) pool.
+
+    At most `workers` jobs are handed to the executor at once and at most
+    `queue_depth` callers may wait for a slot, beyond that requests fail fast.
+    """
+
+    def __init__(self, kind: str = None, workers: int = None, queue_depth: int = None):
+        self.kind = kind or Settings.IMAGE_POOL
+        # cpu_count() is the host's in a container, and each worker can hold a
+        # large bitmap, so only a couple of them are started unless configured
+        self.workers = workers or Settings.IMAGE_WORKERS or min(2, os.cpu_count() or 1)
+        self.queue_depth = queue_depth or Settings.IMAGE_QUEUE_DEPTH
+        self.executor: Executor | None = None
+        self.slots = asyncio.Semaphore(self.workers)
+        self.active = 0
+        self.queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+
+    def start(self):
+        if self.executor is None and self.kind == "process":
+            # forking a server that already runs threads can deadlock the child
+            method = "forkserver" if os.name == "posix" else "spawn"
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(method),
+            )
+        elif self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def run(self, func, *args, **kwargs):
+        if self.queued >= self.queue_depth and self.slots.locked():
+            self.rejected += 1
+            raise exceptions.BaseHTTPException(
+                status_code=503,
+                error="image_queue_full",
+                message="Too many images are being processed, try again later",
+            )
+
+        self.queued += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.queued -= 1
+
+        self.active += 1
+        start = time.perf_counter()
+        try:
+            executor = self.start()
+            with metrics.timer(metrics.IMAGE_ENCODE_SECONDS), stage("image_encode"):
+                return await asyncio.get_running_loop().run_in_executor(
+                    executor, functools.partial(func, *args, **kwargs)
+                )
+        except BrokenExecutor:
+            # a worker died, e.g. by the OOM killer, the next job gets a new pool
+            if self.executor is executor:
+                logging.error("Image pool is broken, restarting it")
+                self.shutdown()
+            raise
+        finally:
+            self.busy_seconds += time.perf_counter() - start
+            self.active -= 1
+            self.completed += 1
+            self.slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "active": self.active,
+            "queued": self.queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "busy_seconds": self.busy_seconds,
+            "utilization": self.active / self.workers,
+        }
+
+
+class ImageFetcher(metaclass=Singleton):
+    """
+    Shared keep-alive client for image downloads.
+
+    Connections are capped per host, downloads are streamed and aborted as
+    soon as they exceed `max_bytes` or the header reports more than
+    `max_pixels`, so oversized images never get fully into memory.
+    """
+
+    def __init__(self, max_bytes: int = None, max_pixels: int = None):
+        self.max_bytes = max_bytes or Settings.IMAGE_MAX_BYTES
+        self.max_pixels = max_pixels or Settings.IMAGE_MAX_PIXELS
+        self.hosts: dict[str, asyncio.Semaphore] = {}
+        self._client: httpx.AsyncClient | None = None
+        self.aborted = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=Settings.IMAGE_MAX_CONNECTIONS,
+                    max_keepalive_connections=Settings.IMAGE_MAX_CONNECTIONS,
+                    keepalive_expiry=Settings.AI_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(
+                    Settings.IMAGE_FETCH_TIMEOUT,
+                    connect=Settings.IMAGE_CONNECT_TIMEOUT,
+                ),
+                http2=importlib.util.find_spec("h2") is not None,
+                follow_redirects=True,
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is None:
+            return
+        client, self._client = self._client, None
+        await client.aclose()
+
+    def host_slots(self, url: str) -> asyncio.Semaphore:
+        host = httpx.URL(url).host
+        if host not in self.hosts:
+            self.hosts[host] = asyncio.Semaphore(
+                Settings.IMAGE_MAX_CONNECTIONS_PER_HOST
+            )
+        return self.hosts[host]
+
+    def reject(self, url: str, reason: str):
+        self.aborted += 1
+        raise exceptions.BaseHTTPException(
+            status_code=413,
+            error="image_too_large",
+            message=f"Image {url} is too large: {reason}",
+        )
+
+    def check_dimensions(self, url: str, content: bytes) -> bool:
+        """True once the image header was parsed, rejecting huge dimensions."""
+
+        try:
+            width, height = Image.open(BytesIO(content)).size
+        except Image.DecompressionBombError:
+            self.reject(url, "too many pixels")
+        except Exception:
+            return False
+        if width * height > self.max_pixels:
+            self.reject(url, f"{width}x{height} pixels")
+        return True
+
+    async def fetch(
+        self, url: str, headers: dict | None = None, timeout: float | None = None
+    ) -> tuple[httpx.Response, bytes]:
+        kwargs = {"timeout": timeout} if timeout else {}
+        async with self.host_slots(url):
+            async with self.client.stream(
+                "GET", url, headers=headers, **kwargs
+            ) as response:
+                if response.status_code == 304:
+                    return response, b""
+                response.raise_for_status()
+
+                try:
+                    length = int(response.headers.get("Content-Length") or 0)
+                except ValueError:
+                    length = 0
+                if length > self.max_bytes:
+                    self.reject(url, f"{length} bytes")
+
+                chunks, size, checked = [], 0, False
+                async for chunk in response.aiter_bytes():
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        self.reject(url, f"more than {self.max_bytes} bytes")
+                    if not checked and 1024 <= size <= 64 * 1024:
+                        checked = self.check_dimensions(url, b"".join(chunks))
+                content = b"".join(chunks)
+                if not checked:
+                    # small images end before the window and big headers after it
+                    self.check_dimensions(url, content)
+                return response, content
+
+
+async def fetch_image(
+    url: str, headers: dict | None = None, timeout: float | None = None
+) -> tuple[httpx.Response, bytes]:
+    with metrics.timer(metrics.IMAGE_DOWNLOAD_SECONDS), stage("image_download"):
+        return await ImageFetcher().fetch(url, headers=headers, timeout=timeout)
+
+
+def validators(response: httpx.Response) -> dict:
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+
+
+def conditional_headers(entry: dict) -> dict:
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+async def revalidate(
+    url: str, entry: dict, timeout: float | None = None
+) -> tuple[dict | None, tuple[httpx.Response, bytes] | None]:
+    """
+    Return the refreshed entry on 304, or the new download when the image
+    has changed.
+    """
+
+    headers = conditional_headers(entry)
+    if not headers:
+        return None, None
+    try:
+        response, content = await fetch_image(url, headers=headers, timeout=timeout)
+    except httpx.HTTPError as e:
+        logging.warning(f"Image revalidation failed, serving cached {url}: {e}")
+        return entry | {"checked_at": time.time()}, None
+
+    if response.status_code == 304:
+        return entry | {"checked_at": time.time()}, None
+    return None, (response, content)
+
+
+async def encode_content(content: bytes, **params) -> bytes:
+    # the bitmap size is known from the header, so it is charged as is
+    async with MemoryBudget().reserve(decoded_bytes(content, **params), ahead=True):
+        return await ImagePool().run(encode_image_bytes, content, **params)
+
+
+async def get_encoded_image(
+    url: str,
+    max_size_kb: int | None = 100,
+    *,
+    format: Literal["JPEG", "PNG", "WEBP"] = "JPEG",
+    quality: int | None = None,
+    timeout: float | None = None,
+    **size,
+) -> bytes:
+    """Download and encode an image, reusing cached encodings of the same URL."""
+
+    params = {"max_size_kb": max_size_kb, "format": format, "quality": quality}
+    params |= {k: v for k, v in size.items() if v}
+    if url.startswith("data:image"):
+        content = base64.b64decode(url.split(",", 1)[1] + "==")
+        return await encode_content(content, **params)
+
+    cache_key = content_hash("image", url, params)
+    entry: dict | None = await image_cache.get(cache_key)
+    fetched = None
+    if entry and time.time() - entry["checked_at"] > Settings.IMAGE_CACHE_FRESH:
+        entry, fetched = await revalidate(url, entry, timeout)
+        if entry:
+            await image_cache.set(cache_key, entry, ttl=Settings.IMAGE_CACHE_TTL)
+    metrics.record_cache("image", bool(entry))
+    if entry:
+        return entry["data"]
+
+    response, content = fetched or await fetch_image(url, timeout=timeout)
+    data = await encode_content(content, **params)
+    entry = {"data": data, "checked_at": time.time(), **validators(response)}
+    await image_cache.set(cache_key, entry, ttl=Settings.IMAGE_CACHE_TTL)
+    return data
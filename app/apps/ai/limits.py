@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from fastapi_mongo_base.core import exceptions
+
+from server.config import Settings
+
+from . import metrics
+from .router import RollingHistogram
+
+
+def get_status_code(e: Exception) -> int | None:
+    for attr in ("status_code", "code", "status"):
+        value = getattr(e, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(e, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def get_retry_after(e: Exception) -> float | None:
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(messages: list, max_tokens: int | None = None) -> int:
+    """Rough input+output token estimate used before the provider reports usage."""
+
+    text_length, images = 0, 0
+    for message in messages:
+        content = message.get("content") if isinstance(message, dict) else message
+        parts = content if isinstance(content, list) else [content]
+        for part in parts:
+            if isinstance(part, str):
+                text_length += len(part)
+            elif isinstance(part, dict) and part.get("type") == "text":
+                text_length += len(part.get("text", ""))
+            else:
+                images += 1
+    return text_length // 4 + images * 85 + (max_tokens or 0)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def delay(self, amount: float) -> float:
+        self.refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self.refill()
+        self.tokens -= amount
+
+
+class EngineLimiter:
+    """
+    Bounds concurrent calls, requests per minute and tokens per minute for one
+    engine. A 429 pauses the engine for Retry-After seconds and halves its
+    request rate, which then recovers gradually on successful calls.
+    Callers that cannot start within `max_wait` seconds get a 503.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        concurrency: int = 0,
+        rpm: float = 0,
+        tpm: float = 0,
+        max_wait: float = None,
+    ):
+        self.name = name
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+        self.rpm = rpm
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_wait = Settings.AI_LIMIT_MAX_WAIT if max_wait is None else max_wait
+        self.blocked_until = 0.0
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.latency = RollingHistogram()
+
+    @classmethod
+    def from_settings(cls, name: str, overrides: dict = None) -> "EngineLimiter":
+        limits = dict(overrides or {})
+        limits |= json.loads(Settings.AI_LIMITS or "{}").get(name, {})
+        return cls(
+            name,
+            concurrency=limits.get("concurrency", Settings.AI_MAX_CONCURRENCY),
+            rpm=limits.get("rpm", Settings.AI_RPM),
+            tpm=limits.get("tpm", Settings.AI_TPM),
+            max_wait=limits.get("max_wait"),
+        )
+
+    def reject(self):
+        self.rejected += 1
+        raise exceptions.BaseHTTPException(
+            status_code=503,
+            error="engine_busy",
+            message=f"{self.name} is at capacity, try again later",
+        )
+
+    def delay(self, tokens: int) -> float:
+        return max(
+            self.blocked_until - time.monotonic(),
+            self.requests.delay(1) if self.requests else 0,
+            self.tokens.delay(tokens) if self.tokens else 0,
+        )
+
+    async def acquire(self, tokens: int):
+        deadline = time.monotonic() + self.max_wait
+        self.waiting += 1
+        try:
+            if self.semaphore:
+                try:
+                    await asyncio.wait_for(
+                        self.semaphore.acquire(), timeout=self.max_wait
+                    )
+                except asyncio.TimeoutError:
+                    self.reject()
+
+            try:
+                while (delay := self.delay(tokens)) > 0:
+                    if time.monotonic() + delay > deadline:
+                        self.reject()
+                    await asyncio.sleep(delay)
+            except BaseException:
+                if self.semaphore:
+                    self.semaphore.release()
+                raise
+        finally:
+            self.waiting -= 1
+
+        if self.requests:
+            self.requests.consume(1)
+        if self.tokens:
+            self.tokens.consume(tokens)
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        if self.semaphore:
+            self.semaphore.release()
+
+    def record_usage(self, estimated: int, actual: int):
+        if self.tokens:
+            self.tokens.consume(actual - estimated)
+
+    def record_success(self):
+        if self.requests and self.requests.capacity < self.rpm:
+            self.requests.capacity = min(self.rpm, self.requests.capacity + 1)
+            self.requests.rate = self.requests.capacity / 60
+
+    def record_rate_limit(self, retry_after: float | None = None):
+        retry_after = retry_after or Settings.AI_RATE_LIMIT_BACKOFF
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        if self.requests:
+            self.requests.capacity = max(1, self.requests.capacity / 2)
+            self.requests.rate = self.requests.capacity / 60
+        logging.warning(f"{self.name} rate limited, pausing for {retry_after}s")
+
+    @asynccontextmanager
+    async def limit(self, tokens: int = 0):
+        await self.acquire(tokens)
+        start = time.monotonic()
+        status = "cancelled"
+        try:
+            yield self
+            self.record_success()
+            status = "ok"
+        except Exception as e:
+            if get_status_code(e) == 429:
+                self.record_rate_limit(get_retry_after(e))
+            status = "error"
+            raise
+        finally:
+            self.release()
+            elapsed = time.monotonic() - start
+            if status != "cancelled":
+                self.latency.observe(elapsed, ok=status == "ok")
+            metrics.PROVIDER_SECONDS.labels(
+                key=metrics.prompt_key.get(), model=self.name, status=status
+            ).observe(elapsed)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "blocked_for": max(0, self.blocked_until - time.monotonic()),
+            "p50": self.latency.quantile(0.5),
+            "p95": self.latency.quantile(0.95),
+            "error_rate": self.latency.error_rate,
+        }
@@ -0,0 +1,142 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager, suppress
+
+from fastapi_mongo_base.core import exceptions
+from singleton import Singleton
+
+from server.config import Settings
+from utils.cache import sizeof
+
+
+def request_bytes(image_urls: list[str], data: dict | None = None) -> int:
+    """
+    Rough peak memory of one request before its images are seen: the downloads,
+    the encoded images and the serialized provider request. Decoded bitmaps are
+    charged separately once their dimensions are known.
+    """
+
+    return len(image_urls) * Settings.IMAGE_MEMORY_ESTIMATE + 4 * sizeof(data or {})
+
+
+def payload_bytes(encoded_images: list[bytes | str], data: dict | None = None) -> int:
+    """Memory of the provider request: the images, their base64 and the body."""
+
+    return 3 * sizeof(encoded_images) + 4 * sizeof(data or {})
+
+
+class Reservation:
+    def __init__(self, budget: "MemoryBudget", size: int):
+        self.budget = budget
+        self.size = size
+
+    def shrink(self, size: int):
+        """Give back what is no longer needed, like the downloaded images."""
+
+        if size < self.size:
+            self.budget.release(self.size - size)
+            self.size = size
+
+
+class MemoryBudget(metaclass=Singleton):
+    """
+    Process-wide byte budget shared by the image pipeline and provider calls.
+
+    Requests reserve their estimated peak memory before any work starts and
+    wait in FIFO order while the budget is used up. A request that cannot get
+    its bytes within `max_wait` seconds fails fast with a 503.
+    """
+
+    def __init__(self, capacity: int = None, max_wait: float = None):
+        self.capacity = capacity or Settings.MEMORY_BUDGET_BYTES
+        self.max_wait = Settings.MEMORY_BUDGET_WAIT if max_wait is None else max_wait
+        self.used = 0
+        self.peak = 0
+        self.rejected = 0
+        self.waiters: deque[tuple[int, asyncio.Future, bool]] = deque()
+
+    def _grant(self, size: int):
+        self.used += size
+        self.peak = max(self.peak, self.used)
+
+    def _wake(self):
+        while self.waiters:
+            size, future, _ = self.waiters[0]
+            if future.done():
+                self.waiters.popleft()
+                continue
+            if self.used + size > self.capacity:
+                return
+            self.waiters.popleft()
+            self._grant(size)
+            future.set_result(None)
+
+    async def acquire(self, size: int, ahead: bool = False) -> int:
+        # a request larger than the whole budget may still run on its own
+        size = min(size, self.capacity)
+        if (ahead or not self.waiters) and self.used + size <= self.capacity:
+            self._grant(size)
+            return size
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (size, future, ahead)
+        if ahead:
+            # behind other work of admitted requests, before new requests
+            index = next(
+                (i for i, (_, _, first) in enumerate(self.waiters) if not first),
+                len(self.waiters),
+            )
+            self.waiters.insert(index, waiter)
+        else:
+            self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(future, timeout=self.max_wait or None)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                self.release(size)
+            else:
+                with suppress(ValueError):
+                    self.waiters.remove(waiter)
+                self._wake()
+            if isinstance(e, asyncio.TimeoutError):
+                self.reject()
+            raise
+        return size
+
+    def release(self, size: int):
+        self.used -= size
+        self._wake()
+
+    def reject(self):
+        self.rejected += 1
+        raise exceptions.BaseHTTPException(
+            status_code=503,
+            error="memory_budget_exhausted",
+            message="Too many requests are in flight, try again later",
+        )
+
+    @asynccontextmanager
+    async def reserve(self, size: int, ahead: bool = False):
+        """
+        Hold `size` bytes. With `ahead`, for work of a request that already holds
+        a reservation, skip the requests still waiting to be admitted, so that
+        the two never wait on each other.
+        """
+
+        size = min(size, self.capacity)
+        if self.max_wait == 0 and self.used + size > self.capacity:
+            self.reject()
+        reservation = Reservation(self, await self.acquire(size, ahead))
+        try:
+            yield reservation
+        finally:
+            self.release(reservation.size)
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "used": self.used,
+            "peak": self.peak,
+            "waiting": len(self.waiters),
+            "rejected": self.rejected,
+        }
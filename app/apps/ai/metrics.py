@@ -0,0 +1,139 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily
+
+# prompt key of the request being served, so provider level metrics can use it
+prompt_key: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "prompt_key", default=""
+)
+# label of requests whose prompt key did not resolve, to bound the cardinality
+UNKNOWN_KEY = "unknown"
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+FAST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_SECONDS = Histogram(
+    "promptly_request_seconds",
+    "End to end time of AI requests",
+    ["key", "model", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "promptly_requests_in_flight", "AI requests being served", ["key"]
+)
+PROVIDER_SECONDS = Histogram(
+    "promptly_provider_seconds",
+    "Time of single provider calls",
+    ["key", "model", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+TOKENS = Counter(
+    "promptly_tokens_total",
+    "Tokens reported by providers",
+    ["key", "model", "kind"],
+)
+COINS = Counter("promptly_coins_total", "Coins charged", ["key", "model"])
+RETRIES = Counter("promptly_retries_total", "Provider call retries", ["model"])
+CACHE_REQUESTS = Counter(
+    "promptly_cache_requests_total", "Cache lookups", ["cache", "result"]
+)
+IMAGE_DOWNLOAD_SECONDS = Histogram(
+    "promptly_image_download_seconds",
+    "Time to download an image",
+    ["status"],
+    buckets=FAST_BUCKETS,
+)
+IMAGE_ENCODE_SECONDS = Histogram(
+    "promptly_image_encode_seconds",
+    "Time to decode, resize and encode an image in the pool",
+    ["status"],
+    buckets=FAST_BUCKETS,
+)
+PROMPT_FETCH_SECONDS = Histogram(
+    "promptly_prompt_fetch_seconds",
+    "Time to fetch prompts from Strapi",
+    ["kind", "status"],
+    buckets=FAST_BUCKETS,
+)
+
+
+@contextmanager
+def timer(histogram: Histogram, **labels):
+    """Observe the duration of the block, labelled with status ok or error."""
+
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        histogram.labels(status=status, **labels).observe(time.perf_counter() - start)
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def record_usage(
+    model: str,
+    input_tokens: int = 0,
+    output_tokens: int = 0,
+    cached_tokens: int = 0,
+    coins: float = 0,
+):
+    key = prompt_key.get()
+    for kind, count in (
+        ("input", input_tokens),
+        ("output", output_tokens),
+        ("cached", cached_tokens),
+    ):
+        if count:
+            TOKENS.labels(key=key, model=model, kind=kind).inc(count)
+    if coins:
+        COINS.labels(key=key, model=model).inc(coins)
+
+
+class StatsCollector:
+    """Exports the stats() of the pools, limiters and budgets as gauges."""
+
+    def describe(self):
+        # names are only known once the engines are loaded
+        return []
+
+    def collect(self):
+        from .engines import EngineCatalog
+        from .images import ImageFetcher, ImagePool
+        from .memory import MemoryBudget
+
+        for name, stats in (
+            ("image_pool", ImagePool().stats()),
+            ("memory_budget", MemoryBudget().stats()),
+            ("image_fetcher", {"aborted": ImageFetcher().aborted}),
+        ):
+            for field, value in stats.items():
+                gauge = GaugeMetricFamily(f"promptly_{name}_{field}", f"{name} {field}")
+                gauge.add_metric([], value)
+                yield gauge
+
+        engines = EngineCatalog()._engines or {}
+        families = {}
+        for engine in engines.values():
+            if engine._limiter is None:
+                continue
+            for field, value in engine.limiter.stats().items():
+                if value is None:
+                    continue
+                if field not in families:
+                    families[field] = GaugeMetricFamily(
+                        f"promptly_engine_{field}", f"engine {field}", labels=["model"]
+                    )
+                families[field].add_metric([engine.name], value)
+        yield from families.values()
+
+
+REGISTRY.register(StatsCollector())
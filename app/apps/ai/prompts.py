@@ -0,0 +1,188 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+import aiofiles
+from singleton import Singleton
+
+from server.config import Settings
+from utils import messages
+
+from . import metrics
+from .schemas import PromptTemplate
+
+
+class PromptRegistry(metaclass=Singleton):
+    """
+    In-process copy of the Strapi prompts.
+
+    All prompts are bulk loaded at startup (from the disk snapshot first, then
+    from Strapi) and kept fresh by a periodic delta sync and the Strapi webhook.
+    Entries younger than `ttl` are served as is. Older entries are still served
+    for another `stale_ttl` seconds while a background task refreshes them.
+    """
+
+    def __init__(self, ttl: float = None, stale_ttl: float = None):
+        self.ttl = ttl or Settings.PROMPT_CACHE_TTL
+        self.stale_ttl = stale_ttl or Settings.PROMPT_STALE_TTL
+        self.entries: dict[str, tuple[float, PromptTemplate]] = {}
+        self.refreshing: dict[str, asyncio.Task] = {}
+        self.synced_at: str | None = None
+        self.loaded = False
+        self.sync_task: asyncio.Task | None = None
+
+    def set(self, template: PromptTemplate):
+        self.entries[template.key] = (time.monotonic(), template)
+        if template.updated_at and template.updated_at > (self.synced_at or ""):
+            self.synced_at = template.updated_at
+
+    async def fetch(self, key: str, raise_exception=True) -> PromptTemplate | None:
+        with metrics.timer(metrics.PROMPT_FETCH_SECONDS, kind="single"):
+            prompt_dict = await messages.get_prompt(
+                key, raise_exception=raise_exception
+            )
+        if prompt_dict is None:
+            return None
+
+        template = PromptTemplate(**prompt_dict)
+        self.set(template)
+        return template
+
+    async def _refresh(self, key: str):
+        try:
+            await self.fetch(key, raise_exception=False)
+        except Exception as e:
+            logging.warning(f"Prompt refresh failed, serving stale {key=}: {e}")
+        finally:
+            self.refreshing.pop(key, None)
+
+    def refresh(self, key: str):
+        if key not in self.refreshing:
+            self.refreshing[key] = asyncio.create_task(self._refresh(key))
+
+    async def get(self, key: str, raise_exception=True) -> PromptTemplate | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return await self.fetch(key, raise_exception=raise_exception)
+
+        fetched_at, template = entry
+        age = time.monotonic() - fetched_at
+        if age > self.ttl + self.stale_ttl:
+            try:
+                return await self.fetch(key, raise_exception=raise_exception)
+            except Exception as e:
+                logging.warning(f"Prompt fetch failed, serving stale {key=}: {e}")
+                return template
+        if age > self.ttl:
+            self.refresh(key)
+        return template
+
+    def search(self, keys: list[str]) -> list[PromptTemplate]:
+        if isinstance(keys, str):
+            keys = [keys]
+        return [
+            template
+            for _, template in self.entries.values()
+            if all(key in template.key for key in keys)
+        ]
+
+    def invalidate(self, key: str | None = None):
+        if key is None:
+            self.entries.clear()
+            self.synced_at = None
+            self.loaded = False
+            return
+        self.entries.pop(key, None)
+
+    async def handle_webhook(self, event: str, entry: dict):
+        # the payload only tells which key changed, the content is read from Strapi
+        key = entry.get("key")
+        if not key:
+            return
+        if event in ("entry.delete", "entry.unpublish"):
+            self.invalidate(key)
+            return
+        await self.fetch(key, raise_exception=False)
+
+    async def sync(self, full: bool = False) -> int:
+        updated_after = None if full else self.synced_at
+        with metrics.timer(metrics.PROMPT_FETCH_SECONDS, kind="sync"):
+            prompts = await messages.get_all_prompts(updated_after=updated_after)
+        now = time.monotonic()
+        self.entries = {
+            key: (now, template) for key, (_, template) in self.entries.items()
+        }
+        for prompt_dict in prompts:
+            self.set(PromptTemplate(**prompt_dict))
+        self.loaded = True
+        if prompts:
+            await self.save_snapshot()
+        return len(prompts)
+
+    async def save_snapshot(self):
+        path = Settings.PROMPT_SNAPSHOT_PATH
+        # replicas share the volume and may all have the same pid
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        data = [
+            template.model_dump(by_alias=True) for _, template in self.entries.values()
+        ]
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            async with aiofiles.open(tmp_path, "w") as f:
+                await f.write(json.dumps(data, ensure_ascii=False))
+            tmp_path.replace(path)
+        except OSError as e:
+            logging.warning(f"Could not save prompt snapshot {path}: {e}")
+            tmp_path.unlink(missing_ok=True)
+
+    async def load_snapshot(self) -> int:
+        path = Settings.PROMPT_SNAPSHOT_PATH
+        if not path.exists():
+            return 0
+
+        async with aiofiles.open(path) as f:
+            data: list[dict] = json.loads(await f.read())
+        for prompt_dict in data:
+            self.set(PromptTemplate(**prompt_dict))
+        self.loaded = True
+        return len(data)
+
+    async def _sync_loop(self, delay: float, full: bool):
+        while True:
+            await asyncio.sleep(delay)
+            delay = Settings.PROMPT_SYNC_INTERVAL
+            try:
+                count = await self.sync(full=full)
+                full = False
+                if count:
+                    logging.info(f"Synced {count} prompts from Strapi")
+            except Exception as e:
+                logging.warning(f"Prompt sync failed: {e}")
+
+    async def start(self):
+        try:
+            loaded = await self.load_snapshot()
+        except Exception as e:
+            logging.warning(f"Could not load prompt snapshot: {e}")
+            loaded = 0
+
+        if loaded:
+            # serve from the snapshot right away and reload everything behind it
+            self.sync_task = asyncio.create_task(self._sync_loop(0, full=True))
+        else:
+            try:
+                loaded = await self.sync(full=True)
+            except Exception as e:
+                logging.warning(f"Prompt preload failed: {e}")
+            self.sync_task = asyncio.create_task(
+                self._sync_loop(Settings.PROMPT_SYNC_INTERVAL, full=not loaded)
+            )
+
+        logging.info(f"Prompt registry ready with {loaded} prompts")
+
+    async def stop(self):
+        if self.sync_task:
+            self.sync_task.cancel()
+            self.sync_task = None
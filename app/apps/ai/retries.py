@@ -0,0 +1,217 @@
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import random
+import time
+
+import httpx
+import openai
+from fastapi_mongo_base.core import exceptions
+
+from server.config import Settings
+
+from . import metrics
+from .limits import get_status_code
+
+TRANSIENT_ERRORS = (
+    TimeoutError,
+    ConnectionError,
+    httpx.TimeoutException,
+    httpx.NetworkError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+)
+
+
+def is_retryable(e: Exception) -> bool:
+    """Timeouts, connection errors, 429 and 5xx are worth another attempt."""
+
+    if isinstance(e, exceptions.BaseHTTPException):
+        # our own rejections (busy engine, open circuit) already waited
+        return False
+    if isinstance(e, TRANSIENT_ERRORS):
+        return True
+    status_code = get_status_code(e)
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+
+class RetryBudget:
+    """
+    Process-wide cap on retries. Every first attempt deposits `ratio` tokens and
+    every retry spends one, so during an outage retries add at most `ratio` extra
+    traffic instead of multiplying it by the number of attempts.
+    """
+
+    def __init__(self, ratio: float = None, capacity: float = None):
+        self.ratio = Settings.AI_RETRY_BUDGET_RATIO if ratio is None else ratio
+        self.capacity = capacity or Settings.AI_RETRY_BUDGET_MAX
+        self.tokens = self.capacity
+        self.exhausted = 0
+
+    def deposit(self):
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            self.exhausted += 1
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RetryPolicy:
+    def __init__(
+        self, attempts: int = None, base_delay: float = None, max_delay: float = None
+    ):
+        self.attempts = attempts or Settings.AI_RETRY_ATTEMPTS
+        self.base_delay = base_delay or Settings.AI_RETRY_BASE_DELAY
+        self.max_delay = max_delay or Settings.AI_RETRY_MAX_DELAY
+
+    @classmethod
+    def from_settings(cls, name: str, overrides: dict = None) -> "RetryPolicy":
+        policy = dict(overrides or {})
+        policy |= json.loads(Settings.AI_RETRIES or "{}").get(name, {})
+        return cls(
+            attempts=policy.get("attempts"),
+            base_delay=policy.get("base_delay"),
+            max_delay=policy.get("max_delay"),
+        )
+
+    def delay(self, attempt: int) -> float:
+        """Full jitter: uniform in [0, min(max_delay, base_delay * 2**attempt)]."""
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive retryable failures and fails fast with a
+    503 for `reset_timeout` seconds. After that a single probe call is let through,
+    closing the circuit on success and re-opening it on failure.
+    """
+
+    def __init__(self, name: str, threshold: int = None, reset_timeout: float = None):
+        self.name = name
+        self.threshold = threshold or Settings.AI_BREAKER_THRESHOLD
+        self.reset_timeout = reset_timeout or Settings.AI_BREAKER_RESET_TIMEOUT
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def before_call(self) -> bool:
+        """Raise while the circuit is open, True if this call is the probe."""
+
+        state = self.state
+        if state == "closed":
+            return False
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        raise exceptions.BaseHTTPException(
+            status_code=503,
+            error="engine_unavailable",
+            message=f"{self.name} is temporarily unavailable, try again later",
+        )
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def release_probe(self):
+        """Let another call probe, after one that neither failed nor succeeded."""
+
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.threshold:
+            if self.opened_at is None or self.probing:
+                logging.warning(f"Circuit opened for {self.name}")
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+
+retry_budget = RetryBudget()
+
+
+async def call_with_retries(
+    func,
+    *args,
+    policy: RetryPolicy,
+    breaker: CircuitBreaker,
+    budget: RetryBudget = retry_budget,
+    **kwargs,
+):
+    budget.deposit()
+    for attempt in range(policy.attempts):
+        probe = breaker.before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            if not is_retryable(e):
+                if probe:
+                    # the engine answered, only the request was bad
+                    breaker.record_success()
+                raise
+            if get_status_code(e) != 429:
+                breaker.record_failure()
+            elif probe:
+                # rate limits are paced by the limiter, not a sign of a broken engine
+                breaker.release_probe()
+            if attempt == policy.attempts - 1 or not budget.withdraw():
+                logging.error(
+                    f"{func.__name__} failed after {attempt + 1} attempts: {e}"
+                )
+                raise
+            delay = policy.delay(attempt)
+            metrics.RETRIES.labels(model=breaker.name).inc()
+            logging.warning(
+                f"Attempt {attempt + 1} failed for {func.__name__}, "
+                f"retrying in {delay:0.2f}s: {e}"
+            )
+            await asyncio.sleep(delay)
+        except BaseException:
+            if probe:
+                breaker.release_probe()
+            raise
+        else:
+            breaker.record_success()
+            return result
+
+
+def retry_engine_call(get_engine):
+    """
+    Retry `func(messages, image_count, model_name, ...)` with the retry policy
+    and circuit breaker of the engine serving `model_name`.
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            engine = get_engine(bound.arguments["model_name"])
+            return await call_with_retries(
+                func,
+                *args,
+                policy=engine.retry_policy,
+                breaker=engine.breaker,
+                **kwargs,
+            )
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,98 @@
+import bisect
+import time
+
+from server.config import Settings
+
+LATENCY_BOUNDS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class RollingHistogram:
+    """
+    Latency histogram and error count over the last `window` seconds, kept as
+    `slots` fixed-bucket slices that are dropped as they age out.
+    """
+
+    def __init__(self, window: float = None, slots: int = 10):
+        self.slot_seconds = (window or Settings.AI_ROUTER_WINDOW) / slots
+        self.slots = slots
+        self.counts: dict[int, list[int]] = {}
+
+    def _current(self) -> list[int]:
+        slot = int(time.monotonic() // self.slot_seconds)
+        for old in [s for s in self.counts if s <= slot - self.slots]:
+            del self.counts[old]
+        # the last counter holds the errors
+        return self.counts.setdefault(slot, [0] * (len(LATENCY_BOUNDS) + 2))
+
+    def observe(self, seconds: float, ok: bool = True):
+        counts = self._current()
+        if ok:
+            counts[bisect.bisect_left(LATENCY_BOUNDS, seconds)] += 1
+        else:
+            counts[-1] += 1
+
+    def merged(self) -> list[int]:
+        self._current()
+        return [sum(column) for column in zip(*self.counts.values())]
+
+    @property
+    def count(self) -> int:
+        return sum(self.merged()[:-1])
+
+    @property
+    def error_rate(self) -> float:
+        merged = self.merged()
+        total = sum(merged)
+        return merged[-1] / total if total else 0
+
+    def quantile(self, q: float) -> float | None:
+        merged = self.merged()[:-1]
+        total = sum(merged)
+        if not total:
+            return None
+
+        rank = q * total
+        for i, count in enumerate(merged):
+            if count and rank <= count:
+                lower = LATENCY_BOUNDS[i - 1] if i else 0
+                upper = LATENCY_BOUNDS[i] if i < len(LATENCY_BOUNDS) else lower * 2
+                return lower + (upper - lower) * rank / count
+            rank -= count
+        return LATENCY_BOUNDS[-1]
+
+
+def score(latency: float, price: float, error_rate: float, policy: dict) -> float:
+    latency_weight = policy.get("latency_weight", 1)
+    cost_weight = policy.get("cost_weight", 1)
+    return (latency_weight * latency + cost_weight * price) / max(0.05, 1 - error_rate)
+
+
+def rank(engines: list, policy: dict) -> list:
+    """
+    Order candidate engines by a weighted mix of tail latency and token price,
+    both relative to the best candidate, penalised by their recent error rate.
+    Engines without enough samples are assumed as fast as the fastest one so
+    they get traffic and measurements.
+    """
+
+    quantile = policy.get("quantile", 0.95)
+    min_samples = policy.get("min_samples", 5)
+    latencies = {}
+    for engine in engines:
+        histogram: RollingHistogram = engine.limiter.latency
+        if histogram.count >= min_samples:
+            latencies[engine.name] = histogram.quantile(quantile)
+
+    best_latency = min(latencies.values(), default=1) or 1
+    best_price = min(engine.input_price + engine.output_price for engine in engines)
+    best_price = best_price or 1
+
+    def key(engine) -> float:
+        return score(
+            latencies.get(engine.name, best_latency) / best_latency,
+            (engine.input_price + engine.output_price) / best_price,
+            engine.limiter.latency.error_rate,
+            policy,
+        )
+
+    return sorted(engines, key=key)
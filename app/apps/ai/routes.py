@@ -1,16 +1,49 @@
+import hmac
+import json
+
 from fastapi import APIRouter, Body, Request
-from fastapi_mongo_base.utils.texttools import format_string_keys
+from fastapi.responses import StreamingResponse
+from fastapi_mongo_base.core import exceptions
 from usso import UserData
 from usso.fastapi import jwt_access_security
 
-from utils.messages import get_prompt
-
-from .schemas import MultipleImagePrompt, Prompt, TranslateRequest, TranslateResponse
-from .services import answer_with_ai, get_prompt_list, translate
+from server.config import Settings
+
+from .prompts import PromptRegistry
+from .schemas import (
+    BatchRequest,
+    MultipleImagePrompt,
+    Prompt,
+    PromptWebhook,
+    TranslateRequest,
+    TranslateResponse,
+)
+from .services import (
+    answer_batch,
+    answer_with_ai,
+    get_prompt_list,
+    stream_with_ai,
+    translate,
+)
 
 router = APIRouter(prefix="/ai", tags=["AI"])
 
 
+def wants_stream(request: Request, stream: bool) -> bool:
+    return stream or "text/event-stream" in request.headers.get("Accept", "")
+
+
+def event_stream(events) -> StreamingResponse:
+    async def sse():
+        async for event in events:
+            data = json.dumps(event["data"], ensure_ascii=False)
+            yield f"event: {event['event']}\ndata: {data}\n\n"
+
+    return StreamingResponse(
+        sse(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
+
+
 @router.get("/", response_model=list[Prompt])
 async def search_ai_keys(key: str):
     prompts = await get_prompt_list([key])
@@ -19,12 +52,22 @@ async def search_ai_keys(key: str):
 
 @router.get("/{key}/fields", response_model=list[str])
 async def get_ai_keys(key: str):
-    prompt: dict = await get_prompt(key)
-    format_keys = format_string_keys(prompt.get("system", "")) | format_string_keys(
-        prompt.get("user", "")
-    )
+    prompt = await PromptRegistry().get(key)
+    return prompt.format_keys
 
-    return format_keys
+
+@router.post("/prompts/webhook")
+async def prompt_webhook(request: Request, data: PromptWebhook):
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    expected = Settings.STRAPI_WEBHOOK_TOKEN
+    # without a configured token anyone could evict prompts, so nobody may
+    if not expected or not hmac.compare_digest(token.encode(), expected.encode()):
+        raise exceptions.BaseHTTPException(
+            status_code=401, error="unauthorized", message="Invalid webhook token"
+        )
+
+    await PromptRegistry().handle_webhook(data.event, data.entry)
+    return {"key": data.entry.get("key"), "event": data.event}
 
 
 @router.post("/translate", response_model=TranslateResponse)
@@ -34,8 +77,13 @@ async def translate_with_ai(request: Request, data: TranslateRequest):
 
 
 @router.post("/{key:str}", response_model=dict)
-async def answer_with_ai_route(request: Request, key: str, data: dict = Body()):
+async def answer_with_ai_route(
+    request: Request, key: str, data: dict = Body(), stream: bool = False
+):
     user: UserData = jwt_access_security(request)
+    if wants_stream(request, stream):
+        await PromptRegistry().get(key)
+        return event_stream(stream_with_ai(key, **data))
     return await answer_with_ai(key, **data)
 
 
@@ -52,16 +100,35 @@ async def answer_image_ai_route(
 
 
 @router.post("/vision/{key:str}", response_model=dict)
-async def answer_images_ai_route(request: Request, key: str, data: MultipleImagePrompt):
+async def answer_images_ai_route(
+    request: Request, key: str, data: MultipleImagePrompt, stream: bool = False
+):
     import logging
 
     import json_advanced as json
 
     logging.info(f"{key} -> {json.dumps(data, ensure_ascii=False)}")
     user: UserData = jwt_access_security(request)
+    if wants_stream(request, stream):
+        await PromptRegistry().get(key)
+        return event_stream(
+            stream_with_ai(key, image_urls=data.image_urls, **data.data)
+        )
     return await answer_with_ai(key, image_urls=data.image_urls, **data.data)
 
 
+@router.post("/batch/{key:str}")
+async def answer_batch_route(request: Request, key: str, data: BatchRequest):
+    user: UserData = jwt_access_security(request)
+    await PromptRegistry().get(key)
+
+    async def ndjson():
+        async for item in answer_batch(key, data.items, data.concurrency):
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
 @router.post("/search/{key}", response_model=dict)
 async def search_with_ai_route(request: Request, key: str, data: dict = Body()):
     user: UserData = jwt_access_security(request)
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from fastapi_mongo_base.core import exceptions
+
+from .engines import AIEngine
+from .retries import is_retryable
+
+Call = Callable[[str], Awaitable[dict]]
+CostEstimate = Callable[[str], float]
+
+
+def should_fall_back(e: Exception) -> bool:
+    if isinstance(e, exceptions.BaseHTTPException):
+        # busy engine or open circuit
+        return e.status_code == 503
+    return is_retryable(e)
+
+
+def estimate_cost(
+    model_name: str, system: str, user: str, image_count: int = 0
+) -> float:
+    """Price of the input of a call that was cancelled before it reported usage."""
+
+    engine = AIEngine.get_by_name(model_name)
+    input_tokens = engine.tokenizer.count(system) + engine.tokenizer.count(user)
+    return engine.get_price(input_tokens, 0, image_count=image_count)
+
+
+async def hedged(
+    call: Call,
+    model_name: str,
+    *,
+    hedge_after: float,
+    hedge_model: str | None = None,
+    cancelled_cost: CostEstimate,
+) -> dict:
+    """
+    Call `model_name` and, if it has not answered after `hedge_after` seconds,
+    race a second call to `hedge_model` against it. The loser is cancelled and
+    its estimated cost is added to the coins of the winner.
+    """
+
+    primary = asyncio.ensure_future(call(model_name))
+    if not hedge_after:
+        return await primary
+
+    tasks = {primary: model_name}
+    pending = {primary}
+    error = None
+    try:
+        done, pending = await asyncio.wait(pending, timeout=hedge_after)
+        if done:
+            return primary.result()
+
+        hedge_model = hedge_model or model_name
+        logging.info(f"Hedging {model_name} with {hedge_model} after {hedge_after}s")
+        hedge = asyncio.ensure_future(call(hedge_model))
+        tasks[hedge] = hedge_model
+        pending.add(hedge)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    result = task.result()
+                    extra = sum(cancelled_cost(tasks[t]) for t in pending)
+                    return result | {"coins": result.get("coins", 0) + extra}
+                error = task.exception()
+        raise error
+    finally:
+        # also reached when the caller is cancelled while waiting
+        for task in pending:
+            task.cancel()
+
+
+async def answer_with_fallback(
+    call: Call,
+    model_name: str,
+    fallback_models: list[str] = (),
+    *,
+    hedge_after: float = 0,
+    hedge_model: str | None = None,
+    cancelled_cost: CostEstimate,
+) -> dict:
+    """Try `model_name` (hedged) and then each fallback model in order."""
+
+    try:
+        return await hedged(
+            call,
+            model_name,
+            hedge_after=hedge_after,
+            hedge_model=hedge_model,
+            cancelled_cost=cancelled_cost,
+        )
+    except Exception as e:
+        if not fallback_models or not should_fall_back(e):
+            raise
+        error = e
+
+    for fallback_model in fallback_models:
+        logging.warning(f"Falling back to {fallback_model}: {error}")
+        try:
+            return await call(fallback_model)
+        except Exception as e:
+            if not should_fall_back(e):
+                raise
+            error = e
+    raise error
@@ -1,5 +1,13 @@
+import json
+import logging
+from functools import cached_property
+from typing import Literal
+
 from fastapi_mongo_base.core.enums import Language
-from pydantic import BaseModel, field_validator
+from fastapi_mongo_base.utils import texttools
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+from server.config import Settings
 
 
 class TranslateRequest(BaseModel):
@@ -9,6 +17,7 @@ class TranslateRequest(BaseModel):
 
 class AIResponse(BaseModel):
     coins: float = 0
+    cached: bool = False
 
 
 class TranslateResponse(AIResponse):
@@ -29,6 +38,82 @@ class Prompt(BaseModel):
         return value or ""
 
 
+class PromptTemplate(Prompt):
+    model_config = ConfigDict(populate_by_name=True)
+
+    system: str | None = ""
+    user: str = ""
+    model_name: str = "gpt-4o"
+    cache_ttl: int = 0
+    image_mode: Literal["inline", "url"] = "inline"
+    fallback_models: list[str] = []
+    hedge_after: int = 0  # milliseconds, 0 disables hedging
+    hedge_model: str | None = None
+    max_coins: float = 0  # estimated coins per call, 0 disables the budget
+    over_budget: Literal["reject", "downgrade"] = "reject"
+    downgrade_model: str | None = None
+    response_schema: dict | None = None  # JSON schema of the answer
+    updated_at: str | None = Field(default=None, alias="updatedAt")
+
+    @field_validator(
+        "user",
+        "model_name",
+        "cache_ttl",
+        "image_mode",
+        "hedge_after",
+        "max_coins",
+        "over_budget",
+        mode="before",
+    )
+    def check_defaults(cls, value, info):
+        return value or cls.model_fields[info.field_name].default
+
+    @field_validator("fallback_models", mode="before")
+    def check_fallback_models(cls, value):
+        if isinstance(value, str):
+            return [model.strip() for model in value.split(",") if model.strip()]
+        return value or []
+
+    @field_validator("response_schema", mode="before")
+    def check_response_schema(cls, value):
+        if isinstance(value, str):
+            try:
+                return json.loads(value) if value.strip() else None
+            except json.JSONDecodeError as e:
+                # a broken schema should not fail loading the whole prompt
+                logging.warning(f"Ignoring invalid response schema: {e}")
+                return None
+        return value or None
+
+    @cached_property
+    def format_keys(self) -> set[str]:
+        return texttools.format_string_keys(self.system) | texttools.format_string_keys(
+            self.user
+        )
+
+    def render(self, **kwargs) -> tuple[str, str]:
+        kwargs["lang"] = kwargs.get("lang", "Persian")
+        for k in self.format_keys:
+            kwargs[k] = kwargs.get(k, "")
+        return self.system.format(**kwargs), self.user.format(**kwargs)
+
+
+class PromptWebhook(BaseModel):
+    event: str
+    model: str | None = None
+    entry: dict = {}
+
+
 class MultipleImagePrompt(AIResponse):
     image_urls: list[str]
     data: dict = {}
+
+
+class BatchItem(BaseModel):
+    data: dict = {}
+    image_urls: list[str] = []
+
+
+class BatchRequest(BaseModel):
+    items: list[BatchItem] = Field(max_length=Settings.AI_BATCH_MAX_ITEMS)
+    concurrency: int | None = Field(default=None, ge=1)
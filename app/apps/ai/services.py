@@ -3,129 +3,369 @@ import json
 import logging
 import os
 import time
+from typing import AsyncGenerator
 
-import langdetect
-from aiocache import cached
-from fastapi_mongo_base.core import enums
-from fastapi_mongo_base.utils import basic, imagetools, texttools
+import orjson
+from fastapi_mongo_base.core import enums, exceptions
+from fastapi_mongo_base.utils import texttools
 
+from server.config import Settings
 from utils import messages
+from utils.cache import TieredCache, content_hash
+from utils.language import detect_language
+from utils.singleflight import SingleFlight
+from utils.timing import add_stages, stage, timed
+
+from . import images, metrics, routing
+from .engines import AIEngine, EngineCatalog
+from .limits import estimate_tokens, get_status_code
+from .memory import MemoryBudget, payload_bytes, request_bytes
+from .prompts import PromptRegistry
+from .retries import retry_engine_call
+from .schemas import BatchItem, Prompt, PromptTemplate
+
+response_cache = TieredCache(
+    Settings.AI_CACHE_MAX_BYTES, Settings.AI_CACHE_DIR, Settings.AI_CACHE_DISK_MAX_BYTES
+)
+answer_flights = SingleFlight()
+image_flights = SingleFlight()
 
-from .engines import AIEngine
-from .schemas import Prompt
 
-
-@cached(ttl=10 * 60)
 async def get_prompt(key, raise_exception=True, **kwargs) -> tuple[str, str, str]:
-    prompt_dict: dict = await messages.get_prompt(key, raise_exception=raise_exception)
+    with stage("prompt", key=key):
+        template = await PromptRegistry().get(key, raise_exception=raise_exception)
+        return render_prompt(template, **kwargs)
 
-    kwargs["lang"] = kwargs.get("lang", "Persian")
-    for k in list(
-        texttools.format_string_keys(prompt_dict.get("system") or "")
-        | texttools.format_string_keys(prompt_dict.get("user") or "")
-    ):
-        kwargs[k] = kwargs.get(k, "")
 
-    system: str = (prompt_dict.get("system") or "").format(**kwargs)
-    user: str = (prompt_dict.get("user") or "").format(**kwargs)[:40000]
-    model_name: str = prompt_dict.get("model_name", "gpt-4o")
+def render_prompt(template: PromptTemplate, **kwargs) -> tuple[str, str, str]:
+    system, user = template.render(**kwargs)
+    engine = AIEngine.get_by_name(template.model_name)
+    user = engine.truncate(system, user, output_tokens(**kwargs))
+    return system, user, template.model_name
 
-    return system, user, model_name
+
+def output_tokens(**kwargs) -> int:
+    return (
+        kwargs.get("max_tokens")
+        or kwargs.get("max_output_tokens")
+        or Settings.AI_OUTPUT_TOKENS_ESTIMATE
+    )
+
+
+def check_budget(
+    template: PromptTemplate,
+    system: str,
+    user: str,
+    image_count: int,
+    model_name: str,
+    **kwargs,
+) -> str:
+    """
+    Estimate the coins of the call before sending it. Over the prompt's
+    `max_coins` the request is rejected, or moved to `downgrade_model` when the
+    prompt allows it and the cheaper model fits the budget.
+    """
+
+    if not template.max_coins:
+        return model_name
+
+    tokens = output_tokens(**kwargs)
+    estimate = AIEngine.get_by_name(model_name).estimate_price(
+        system, user, image_count, tokens
+    )
+    if estimate <= template.max_coins:
+        return model_name
+
+    if template.over_budget == "downgrade" and template.downgrade_model:
+        engine = AIEngine.get_by_name(template.downgrade_model)
+        downgraded = engine.estimate_price(
+            system, engine.truncate(system, user, tokens), image_count, tokens
+        )
+        if downgraded <= template.max_coins:
+            logging.info(
+                f"Downgrading {template.key} from {model_name} to {engine.name}, "
+                f"estimated {estimate:0.4f} > {template.max_coins} coins"
+            )
+            return engine.name
+
+    raise exceptions.BaseHTTPException(
+        status_code=402,
+        error="budget_exceeded",
+        message=(
+            f"Estimated cost {estimate:0.4f} exceeds the {template.max_coins} "
+            f"coins budget of {template.key}"
+        ),
+    )
 
 
 async def get_prompt_list(keys: list[str], raise_exception=True) -> list[Prompt]:
+    registry = PromptRegistry()
+    if registry.loaded:
+        return registry.search(keys)
+
     res: dict = await messages.get_prompt_list(keys, raise_exception=raise_exception)
     data: list[Prompt] = res.get("data", [])
     return [Prompt(**d.get("attributes", {})) for d in data]
 
 
-def messages_gemini_old(system: str, user: str, encoded_images: list[str], **kwargs):
+def messages_gemini_old(
+    system: str,
+    user: str,
+    encoded_images: list[bytes],
+    mime_type: str = "image/jpeg",
+    **kwargs,
+):
     res = [system, user] if system else [user]
     for encoded_image in encoded_images:
-        res.append({"mime_type": "image/jpeg", "data": encoded_image})
+        res.append({"mime_type": mime_type, "data": encoded_image})
     return res
 
 
-def messages_gemini(system: str, user: str, encoded_images: list[str], **kwargs):
+def messages_gemini(
+    system: str,
+    user: str,
+    encoded_images: list[bytes],
+    mime_type: str = "image/jpeg",
+    **kwargs,
+):
     from google.genai import types
 
     res = [system, user] if system else [user]
     for encoded_image in encoded_images:
-        res.append(types.Part.from_bytes(data=encoded_image, mime_type="image/jpeg"))
+        res.append(types.Part.from_bytes(data=encoded_image, mime_type=mime_type))
     return res
 
 
 def messages_openai(
-    system: str, user: str, encoded_images: list[str], low_res: bool = True, **kwargs
+    system: str,
+    user: str,
+    encoded_images: list[bytes | str],
+    low_res: bool = True,
+    mime_type: str = "image/jpeg",
+    **kwargs,
 ):
+    """Images are inlined as data URLs, strings are sent as image URLs as is."""
+
     if not encoded_images:
         return [
             {"role": "system", "content": system},
-            {"role": "user", "content": user[:40000]},
+            {"role": "user", "content": user},
         ]
 
     low_res_dict = {"detail": "low"} if low_res else {}
-    images = [
-        {"type": "image_url", "image_url": {"url": image, **low_res_dict}}
+    image_parts = [
+        {
+            "type": "image_url",
+            "image_url": {
+                "url": (
+                    image
+                    if isinstance(image, str)
+                    else images.data_url(image, mime_type)
+                ),
+                **low_res_dict,
+            },
+        }
         for image in encoded_images
     ]
     return [
         {"role": "system", "content": system},
         {
             "role": "user",
-            "content": [{"type": "text", "text": user[:40000]}, *images],
+            "content": [{"type": "text", "text": user}, *image_parts],
         },
     ]
 
 
+async def encode_image(image_url: str, **kwargs) -> bytes:
+    params = {"max_size_kb": 100, "format": "JPEG"} | kwargs
+    # coalesced downloads report their stages to every request sharing them
+    encoded, stages = await image_flights.do(
+        content_hash(image_url, params),
+        timed,
+        images.get_encoded_image,
+        image_url,
+        **params,
+    )
+    add_stages(stages)
+    return encoded
+
+
+async def encode_images(
+    image_urls: list[str], model_name: str = None, low_res: bool = True
+) -> list[bytes]:
+    params = {}
+    if model_name:
+        params = AIEngine.get_by_name(model_name).image_params(low_res)
+    with stage("images", count=len(image_urls)):
+        return await asyncio.gather(
+            *[encode_image(url, **params) for url in image_urls]
+        )
+
+
+def build_messages(
+    system: str,
+    user: str,
+    encoded_images: list[bytes | str],
+    model_name: str,
+    *,
+    low_res: bool = True,
+    **kwargs,
+) -> list:
+    engine = AIEngine.get_by_name(model_name)
+    # images were encoded with the engine's params, so their type follows them
+    mime_type = images.mime_type(engine.image_params(low_res)["format"])
+    with stage("messages"):
+        user = engine.truncate(system, user, output_tokens(**kwargs))
+        if model_name.startswith("gemini"):
+            return messages_gemini(
+                system, user, encoded_images, mime_type=mime_type, **kwargs
+            )
+        return messages_openai(
+            system,
+            user,
+            encoded_images,
+            low_res=low_res,
+            mime_type=mime_type,
+            **kwargs,
+        )
+
+
 async def make_messages(
     key: str, *, image_urls: list[str] = [], low_res: bool = True, **kwargs
 ) -> tuple[list[dict], str]:
     system, user, model_name = await get_prompt(key, **kwargs)
+    encoded_images = await encode_images(image_urls, model_name, low_res)
+    messages = build_messages(
+        system, user, encoded_images, model_name, low_res=low_res, **kwargs
+    )
+    return messages, model_name
 
-    encoded_images = await asyncio.gather(
-        *[
-            imagetools.download_image_base64(
-                image_url,
-                max_size_kb=100,
-                format="JPEG",
-                include_base64_header=False,
-                timeout=30,
-            )
-            for image_url in image_urls
-        ]
+
+def response_cache_key(
+    system: str,
+    user: str,
+    encoded_images: list[bytes | str],
+    model_name: str,
+    **kwargs,
+) -> str:
+    params = {
+        k: kwargs.get(k)
+        for k in (
+            "temperature",
+            "max_tokens",
+            "max_output_tokens",
+            "top_p",
+            "top_k",
+            "low_res",
+            "response_schema",
+        )
+    }
+    return content_hash(
+        model_name,
+        params,
+        system,
+        user,
+        *[content_hash(image) for image in encoded_images],
     )
-    if model_name.startswith("gemini"):
-        messages = messages_gemini(system, user, encoded_images, **kwargs)
-        return messages, model_name
 
-    messages = messages_openai(system, user, encoded_images, low_res=low_res, **kwargs)
-    return messages, model_name
+
+def cached_tokens(usage) -> int:
+    """Prompt tokens served from the provider's prompt cache."""
+
+    details = getattr(usage, "prompt_tokens_details", None)
+    if details is not None:
+        return getattr(details, "cached_tokens", 0) or 0
+    return getattr(usage, "cached_content_token_count", 0) or 0
+
+
+def extract_json(text: str, structured: bool = False) -> dict:
+    """
+    Structured answers are parsed as a whole with the fast parser, free text is
+    searched for its outermost JSON object. Raises `json.JSONDecodeError`.
+    """
+
+    if structured:
+        try:
+            result = orjson.loads(text)
+            return result if isinstance(result, dict) else {"answer": result}
+        except ValueError:
+            logging.warning("Structured answer is not valid JSON, extracting")
+    return texttools.json_extractor(text)
+
+
+def strict_schema(schema) -> bool:
+    """
+    Whether OpenAI's strict mode accepts `schema`: every object disallows
+    additional properties and lists all of its properties as required.
+    """
+
+    if isinstance(schema, list):
+        return all(strict_schema(item) for item in schema)
+    if not isinstance(schema, dict):
+        return True
+    if schema.get("type") == "object" or "properties" in schema:
+        properties = schema.get("properties", {})
+        if schema.get("additionalProperties") is not False or set(
+            schema.get("required", [])
+        ) != set(properties):
+            return False
+    return all(strict_schema(value) for value in schema.values())
+
+
+def openai_response_format(engine: AIEngine, schema: dict | None) -> dict:
+    # engines without structured output get the schema from the prompt only
+    if not schema or not engine.structured_output:
+        return {}
+    # strict mode rejects other schemas with a 400, so they are only a hint
+    json_schema = {"name": "answer", "schema": schema, "strict": strict_schema(schema)}
+    return {"response_format": {"type": "json_schema", "json_schema": json_schema}}
+
+
+def gemini_config(engine: AIEngine, schema: dict | None):
+    if not schema or not engine.structured_output:
+        return None
+
+    from google.genai import types
+
+    return types.GenerateContentConfig(
+        response_mime_type="application/json", response_json_schema=schema
+    )
 
 
-@basic.retry_execution(3, delay=5)
+@retry_engine_call(AIEngine.get_by_name)
 async def answer_openai(
     messages: list[dict], image_count: int, model_name: str, **kwargs
 ):
-    import openai
-
     engine = AIEngine.get_by_name(model_name)
-
-    # api_key=os.environ.get("OPENAI_API_KEY")
-    openai_client = openai.AsyncOpenAI(**engine.get_dict())
-    response = await openai_client.chat.completions.create(
-        model=model_name,
-        messages=messages,
-        max_tokens=kwargs.get("max_tokens"),
-        temperature=kwargs.get("temperature", 0.1),
-    )
+    estimated_tokens = estimate_tokens(messages, kwargs.get("max_tokens"))
+    async with engine.limiter.limit(estimated_tokens):
+        with stage("provider", model=model_name):
+            response = await engine.client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                max_tokens=kwargs.get("max_tokens"),
+                temperature=kwargs.get("temperature", 0.1),
+                **openai_response_format(engine, kwargs.get("response_schema")),
+            )
+    engine.limiter.record_usage(estimated_tokens, response.usage.total_tokens)
     coins = engine.get_price(
         response.usage.prompt_tokens,
         response.usage.completion_tokens,
         image_count=image_count,
     )
+    metrics.record_usage(
+        model_name,
+        response.usage.prompt_tokens,
+        response.usage.completion_tokens,
+        cached_tokens(response.usage),
+        coins,
+    )
     try:
-        resp = texttools.json_extractor(response.choices[0].message.content)
+        with stage("parse"):
+            resp = extract_json(
+                response.choices[0].message.content,
+                structured=bool(kwargs.get("response_schema")),
+            )
         return resp | {"coins": coins, "model": model_name}
     except json.JSONDecodeError:
         return {
@@ -138,7 +378,7 @@ async def answer_openai(
         raise
 
 
-@basic.retry_execution(3, delay=5)
+@retry_engine_call(AIEngine.get_by_name)
 async def answer_gemini_old(
     messages: list[dict], image_count: int, model_name="gemini-1.5-flash", **kwargs
 ):
@@ -154,14 +394,24 @@ async def answer_gemini_old(
     # genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
     try:
         model = genai.GenerativeModel(model_name)
-        response = model.generate_content(messages)
+        async with engine.limiter.limit(estimate_tokens(messages)):
+            with stage("provider", model=model_name):
+                response = await asyncio.to_thread(model.generate_content, messages)
 
         coins = engine.get_price(
             response.usage_metadata.prompt_token_count,
             response.usage_metadata.candidates_token_count,
             image_count=image_count,
         )
-        resp = texttools.json_extractor(response.text)
+        metrics.record_usage(
+            model_name,
+            response.usage_metadata.prompt_token_count,
+            response.usage_metadata.candidates_token_count,
+            cached_tokens(response.usage_metadata),
+            coins,
+        )
+        with stage("parse"):
+            resp = texttools.json_extractor(response.text)
         return resp | {"coins": coins, "model": model_name}
     except json.JSONDecodeError:
         return {
@@ -177,15 +427,10 @@ async def answer_gemini_old(
         raise
 
 
-@basic.retry_execution(3, delay=5)
+@retry_engine_call(AIEngine.get_by_name)
 async def answer_gemini(
     messages: list[dict], image_count: int, model_name="gemini-2.0-flash", **kwargs
 ):
-    from google import genai
-    from google.genai import types
-
-    http_options = types.HttpOptions(base_url="https://api.metisai.ir")
-
     generation_config = {
         "temperature": kwargs.get("temperature", 0.1),
         "top_p": kwargs.get("top_p", 0.95),
@@ -195,16 +440,33 @@ async def answer_gemini(
     }
     try:
         engine = AIEngine.get_by_name(model_name)
-        client = genai.Client(
-            api_key=os.getenv("METIS_API_KEY"), http_options=http_options
+        estimated_tokens = estimate_tokens(messages)
+        async with engine.limiter.limit(estimated_tokens):
+            with stage("provider", model=model_name):
+                response = await engine.client.aio.models.generate_content(
+                    model=model_name,
+                    contents=messages,
+                    config=gemini_config(engine, kwargs.get("response_schema")),
+                )
+        engine.limiter.record_usage(
+            estimated_tokens, response.usage_metadata.total_token_count or 0
         )
-        response = client.models.generate_content(model=model_name, contents=messages)
         coins = engine.get_price(
             response.usage_metadata.prompt_token_count,
             response.usage_metadata.candidates_token_count,
             image_count=image_count,
         )
-        resp = texttools.json_extractor(response.text)
+        metrics.record_usage(
+            model_name,
+            response.usage_metadata.prompt_token_count,
+            response.usage_metadata.candidates_token_count,
+            cached_tokens(response.usage_metadata),
+            coins,
+        )
+        with stage("parse"):
+            resp = extract_json(
+                response.text, structured=bool(kwargs.get("response_schema"))
+            )
         return resp | {"coins": coins, "model": model_name}
     except json.JSONDecodeError:
         return {
@@ -220,26 +482,222 @@ async def answer_gemini(
         raise
 
 
-# @cached(ttl=24 * 3600)
 async def answer_with_ai(key, *, image_urls: list[str] = [], **kwargs) -> dict:
     kwargs["lang"] = kwargs.get("lang", "Persian")
+    start_time = time.perf_counter()
+    label, result, status = metrics.UNKNOWN_KEY, {}, "error"
+    try:
+        # keys become labels only once they resolve, so bad keys add no series
+        await PromptRegistry().get(key)
+        label = key
+        token = metrics.prompt_key.set(key)
+        in_flight = metrics.REQUESTS_IN_FLIGHT.labels(key=key)
+        in_flight.inc()
+        try:
+            result, stages = await answer_flights.do(
+                content_hash(key, image_urls, kwargs),
+                timed,
+                _answer_with_ai,
+                key,
+                image_urls=image_urls,
+                **kwargs,
+            )
+            add_stages(stages)
+            status = "cached" if result.get("cached") else "ok"
+            return dict(result)
+        finally:
+            in_flight.dec()
+            metrics.prompt_key.reset(token)
+    finally:
+        metrics.REQUEST_SECONDS.labels(
+            key=label, model=result.get("model", ""), status=status
+        ).observe(time.perf_counter() - start_time)
+
+
+def parse_answer(text: str, structured: bool = False) -> dict:
+    try:
+        return extract_json(text, structured)
+    except json.JSONDecodeError:
+        return {"answer": texttools.backtick_formatter(text)}
+
+
+async def stream_openai(
+    messages: list[dict], image_count: int, model_name: str, **kwargs
+) -> AsyncGenerator[dict, None]:
+    engine = AIEngine.get_by_name(model_name)
+    chunks, usage = [], None
+    async with engine.limiter.limit(
+        estimate_tokens(messages, kwargs.get("max_tokens"))
+    ):
+        stream = await engine.client.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            max_tokens=kwargs.get("max_tokens"),
+            temperature=kwargs.get("temperature", 0.1),
+            stream=True,
+            stream_options={"include_usage": True},
+            **openai_response_format(engine, kwargs.get("response_schema")),
+        )
+        async for chunk in stream:
+            usage = chunk.usage or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                chunks.append(chunk.choices[0].delta.content)
+                yield {"event": "delta", "data": {"text": chunks[-1]}}
+
+    input_tokens = usage.prompt_tokens if usage else 0
+    output_tokens = usage.completion_tokens if usage else 0
+    coins = engine.get_price(input_tokens, output_tokens, image_count=image_count)
+    metrics.record_usage(
+        model_name, input_tokens, output_tokens, cached_tokens(usage), coins
+    )
+    yield {
+        "event": "done",
+        "data": parse_answer("".join(chunks), bool(kwargs.get("response_schema")))
+        | {
+            "coins": coins,
+            "model": model_name,
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+        },
+    }
+
+
+async def stream_gemini(
+    messages: list, image_count: int, model_name="gemini-2.0-flash", **kwargs
+) -> AsyncGenerator[dict, None]:
+    engine = AIEngine.get_by_name(model_name)
+    chunks, usage = [], None
+    async with engine.limiter.limit(estimate_tokens(messages)):
+        stream = await engine.client.aio.models.generate_content_stream(
+            model=model_name,
+            contents=messages,
+            config=gemini_config(engine, kwargs.get("response_schema")),
+        )
+        async for chunk in stream:
+            usage = chunk.usage_metadata or usage
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield {"event": "delta", "data": {"text": chunk.text}}
+
+    input_tokens = (usage.prompt_token_count or 0) if usage else 0
+    output_tokens = (usage.candidates_token_count or 0) if usage else 0
+    coins = engine.get_price(input_tokens, output_tokens, image_count=image_count)
+    metrics.record_usage(
+        model_name, input_tokens, output_tokens, cached_tokens(usage), coins
+    )
+    yield {
+        "event": "done",
+        "data": parse_answer("".join(chunks), bool(kwargs.get("response_schema")))
+        | {
+            "coins": coins,
+            "model": model_name,
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+        },
+    }
+
+
+async def answer_messages(
+    messages: list, image_count: int, model_name: str, **kwargs
+) -> dict:
+    if model_name.startswith("gemini"):
+        return await answer_gemini(messages, image_count, model_name, **kwargs)
+    return await answer_openai(messages, image_count, model_name, **kwargs)
 
+
+def is_image_url_error(e: Exception) -> bool:
+    """A provider 400 for an image URL it could not download or accept."""
+
+    if get_status_code(e) != 400:
+        return False
+    text = f"{getattr(e, 'code', '')} {e}".lower()
+    return "image" in text and any(
+        word in text for word in ("download", "invalid", "fetch", "url")
+    )
+
+
+async def answer_model(
+    system: str,
+    user: str,
+    image_urls: list[str],
+    model_name: str,
+    *,
+    image_mode: str = "inline",
+    **kwargs,
+) -> dict:
+    """Answer with one model, sending image URLs as is when the prompt allows it."""
+
+    if image_mode == "url" and image_urls and not model_name.startswith("gemini"):
+        messages = build_messages(system, user, image_urls, model_name, **kwargs)
+        try:
+            return await answer_openai(messages, len(image_urls), model_name, **kwargs)
+        except Exception as e:
+            if not is_image_url_error(e):
+                raise
+            logging.warning(f"Image URL passthrough failed, inlining: {e}")
+
+    async with MemoryBudget().reserve(request_bytes(image_urls, kwargs)) as reserved:
+        encoded_images = await encode_images(
+            image_urls, model_name, kwargs.get("low_res", True)
+        )
+        # the downloads are gone, only the payload lives through the provider call
+        reserved.shrink(payload_bytes(encoded_images, kwargs))
+        messages = build_messages(system, user, encoded_images, model_name, **kwargs)
+        return await answer_messages(messages, len(image_urls), model_name, **kwargs)
+
+
+async def _answer_with_ai(key, *, image_urls: list[str] = [], **kwargs) -> dict:
     # logging.info(f"{model_name=} {messages=}")
 
     try:
-        messages, model_name = await make_messages(key, image_urls=image_urls, **kwargs)
-        start_time = time.time()
-        if model_name.startswith("gemini"):
-            result = await answer_gemini(
-                messages, len(image_urls), model_name, **kwargs
+        with stage("prompt", key=key):
+            template = await PromptRegistry().get(key)
+            system, user, model_name = render_prompt(template, **kwargs)
+        if template.response_schema:
+            kwargs["response_schema"] = template.response_schema
+        image_mode = kwargs.pop("image_mode", None) or template.image_mode
+
+        cache_key = None
+        if template.cache_ttl:
+            passthrough = image_mode == "url" and not model_name.startswith("gemini")
+            if passthrough:
+                encoded_images = image_urls
+            else:
+                async with MemoryBudget().reserve(request_bytes(image_urls)):
+                    encoded_images = await encode_images(
+                        image_urls, model_name, kwargs.get("low_res", True)
+                    )
+            cache_key = response_cache_key(
+                system, user, encoded_images, model_name, **kwargs
             )
-        else:
-            result = await answer_openai(
-                messages, len(image_urls), model_name, **kwargs
+            cached_result = await response_cache.get(cache_key)
+            metrics.record_cache("response", cached_result is not None)
+            if cached_result is not None:
+                return cached_result | {"coins": 0, "cached": True}
+
+        async def call(model: str) -> dict:
+            return await answer_model(
+                system, user, image_urls, model, image_mode=image_mode, **kwargs
             )
+
+        models = EngineCatalog().route(key, model_name)
+        models[0] = check_budget(
+            template, system, user, len(image_urls), models[0], **kwargs
+        )
+        start_time = time.time()
+        result = await routing.answer_with_fallback(
+            call,
+            models[0],
+            template.fallback_models or models[1:],
+            hedge_after=template.hedge_after / 1000,
+            hedge_model=template.hedge_model,
+            cancelled_cost=lambda model: routing.estimate_cost(
+                model, system, user, len(image_urls)
+            ),
+        )
         logging.info(
             f"Time taken: {model_name=} {key=} {time.time() - start_time:0.2f} seconds"
         )
+        if cache_key:
+            await response_cache.set(cache_key, result, ttl=template.cache_ttl)
         return result
 
     except Exception as e:
@@ -248,20 +706,114 @@ async def answer_with_ai(key, *, image_urls: list[str] = [], **kwargs) -> dict:
         raise
 
 
-async def translate(
-    text: str, target_language: enums.Language = enums.Language.English, **kwargs
-):
+async def stream_with_ai(
+    key, *, image_urls: list[str] = [], **kwargs
+) -> AsyncGenerator[dict, None]:
+    """
+    Stream provider tokens as `delta` events, then one `done` event with coins.
+
+    Streams pass the budget check but are not retried or failed over to other
+    models, since sent deltas cannot be taken back. Any error, including an
+    unknown prompt, ends the stream with an `error` event.
+    """
+
+    kwargs["lang"] = kwargs.get("lang", "Persian")
+    start_time = time.perf_counter()
+    label, model_name, status, in_flight = metrics.UNKNOWN_KEY, "", "error", None
+    try:
+        with stage("prompt", key=key):
+            template = await PromptRegistry().get(key)
+            system, user, model_name = render_prompt(template, **kwargs)
+        label = key
+        # the generator runs in the response's own task, so the key is not reset
+        metrics.prompt_key.set(key)
+        in_flight = metrics.REQUESTS_IN_FLIGHT.labels(key=key)
+        in_flight.inc()
+        if template.response_schema:
+            kwargs["response_schema"] = template.response_schema
+        model_name = check_budget(
+            template, system, user, len(image_urls), model_name, **kwargs
+        )
+        stream = stream_gemini if model_name.startswith("gemini") else stream_openai
+        async with MemoryBudget().reserve(
+            request_bytes(image_urls, kwargs)
+        ) as reserved:
+            encoded_images = await encode_images(
+                image_urls, model_name, kwargs.get("low_res", True)
+            )
+            reserved.shrink(payload_bytes(encoded_images, kwargs))
+            messages = build_messages(
+                system, user, encoded_images, model_name, **kwargs
+            )
+            async for event in stream(messages, len(image_urls), model_name, **kwargs):
+                yield event
+        status = "ok"
+    except Exception as e:
+        logging.error(f"AI stream failed, {type(e)} {e} {key=}")
+        yield {"event": "error", "data": {"error": f"{type(e).__name__}: {e}"}}
+    finally:
+        if in_flight is not None:
+            in_flight.dec()
+        metrics.REQUEST_SECONDS.labels(
+            key=label, model=model_name, status=status
+        ).observe(time.perf_counter() - start_time)
+
+
+async def answer_batch(
+    key: str, items: list[BatchItem], concurrency: int | None = None
+) -> AsyncGenerator[dict, None]:
+    """Answer every item against one prompt key, yielding results as they finish."""
+
+    concurrency = min(
+        concurrency or Settings.AI_BATCH_CONCURRENCY, Settings.AI_BATCH_MAX_CONCURRENCY
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer_item(index: int, item: BatchItem) -> dict:
+        async with semaphore:
+            try:
+                result = await answer_with_ai(
+                    key, image_urls=item.image_urls, **item.data
+                )
+                return {"index": index, "result": result}
+            except Exception as e:
+                return {"index": index, "error": f"{type(e).__name__}: {e}"}
+
+    tasks = [asyncio.create_task(answer_item(i, item)) for i, item in enumerate(items)]
+    coins, errors = 0, 0
     try:
-        lang = langdetect.detect(text)
-    except:
-        lang = "en"
+        for task in asyncio.as_completed(tasks):
+            item_result = await task
+            if "error" in item_result:
+                errors += 1
+            else:
+                coins += item_result["result"].get("coins", 0)
+            yield item_result
+    finally:
+        for task in tasks:
+            task.cancel()
 
-    if lang == target_language:
-        return text
+    yield {"done": True, "count": len(items), "errors": errors, "coins": coins}
 
+
+async def translate(
+    text: str, target_language: enums.Language = enums.Language.English, **kwargs
+):
     if not enums.Language.has_value(target_language):
         target_language = enums.Language.English
+    target_language = enums.Language(target_language)
+
+    if detect_language(text) == target_language:
+        return {"translated_text": text, "coins": 0}
+
+    cache_key = content_hash("translate", text, target_language, kwargs)
+    cached_result = await response_cache.get(cache_key)
+    metrics.record_cache("translate", cached_result is not None)
+    if cached_result is not None:
+        return cached_result | {"coins": 0, "cached": True}
 
-    return await answer_with_ai(
-        "translate", text=text, target_language=target_language, **kwargs
+    result = await answer_with_ai(
+        "translate", text=text, target_language=target_language.value, **kwargs
     )
+    await response_cache.set(cache_key, result, ttl=Settings.TRANSLATE_CACHE_TTL)
+    return result
@@ -0,0 +1,63 @@
+import functools
+import importlib.util
+import logging
+import math
+
+ENCODINGS = {
+    "gpt-4o": "o200k_base",
+    "gpt-4.1": "o200k_base",
+    "o1": "o200k_base",
+    "o3": "o200k_base",
+    "gpt-4": "cl100k_base",
+    "gpt-3.5": "cl100k_base",
+}
+
+
+class Tokenizer:
+    """
+    Counts and truncates text in tokens. Uses tiktoken when it is installed and
+    the encoding is known, otherwise a UTF-8 byte heuristic (4 bytes a token)
+    that over-counts non-Latin scripts rather than under-counting them.
+    """
+
+    def __init__(self, encoding: str | None = None):
+        self.name = "heuristic"
+        self.encoding = None
+        if encoding and importlib.util.find_spec("tiktoken"):
+            import tiktoken
+
+            try:
+                self.encoding = tiktoken.get_encoding(encoding)
+                self.name = encoding
+            except Exception as e:
+                # the encoding files are downloaded on first use
+                logging.warning(f"Could not load {encoding}, counting by bytes: {e}")
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text.encode()) / 4)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            return self.encoding.decode(tokens[:max_tokens])
+        return text.encode()[: max_tokens * 4].decode(errors="ignore")
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer(name: str) -> Tokenizer:
+    """Tokenizer for a model name or an explicit tiktoken encoding name."""
+
+    if name.endswith("_base"):
+        return Tokenizer(name)
+    for prefix, encoding in ENCODINGS.items():
+        if name.startswith(prefix):
+            return Tokenizer(encoding)
+    return Tokenizer()
@@ -0,0 +1,250 @@
+"""
+Load generator for the AI endpoints against local stand-ins.
+
+Strapi, the OpenAI and Gemini APIs and the image host are served by the stub
+app of the test suite, so runs need no network or credentials and repeat. The
+service runs in its own uvicorn process (see `benchmarks.serve`), and the
+resident memory of that process and its image workers is sampled during each
+scenario.
+
+    python -m benchmarks.load --concurrency 32 --requests 500 --latency 0.2
+"""
+
+import argparse
+import asyncio
+import glob
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+from tests.stubs import PROMPTS, StubServer, create_stub_app
+
+from .report import compare, percentile, print_table, save
+
+PROMPTS["translate"] = {
+    "key": "translate",
+    "system": "you are a translator",
+    "user": "translate {text} to {target_language}",
+    "model_name": "gpt-4o-mini",
+}
+
+
+def text_request(i: int, stub_url: str) -> tuple[str, dict]:
+    return "/ai/stub_text", {"text": f"benchmark request {i}"}
+
+
+def vision_request(i: int, stub_url: str) -> tuple[str, dict]:
+    # unique URLs, so every request downloads and encodes its images
+    image_urls = [f"{stub_url}/images/bench-{i}-{j}.jpg" for j in range(3)]
+    return "/ai/vision/stub_vision", {
+        "image_urls": image_urls,
+        "data": {"summary": f"product {i}"},
+    }
+
+
+def translate_request(i: int, stub_url: str) -> tuple[str, dict]:
+    return "/ai/translate", {
+        "text": f"this is the benchmark sentence number {i} for the translator",
+        "target_language": "Persian",
+    }
+
+
+SCENARIOS = {
+    "text": text_request,
+    "vision": vision_request,
+    "translate": translate_request,
+}
+
+
+def start_stubs(args) -> StubServer:
+    app = create_stub_app(
+        args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        answer={"ok": True, "translated_text": "ترجمه"},
+    )
+    app.state.image_latency = args.image_latency
+    return StubServer(app).start()
+
+
+def start_service(stub_url: str, timeout: float = 30) -> tuple[subprocess.Popen, str]:
+    from server.config import Settings
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    env = os.environ | {
+        "METIS_URL": stub_url,
+        "METIS_API_KEY": "stub",
+        "STRAPI_URL": f"{stub_url}/api/prompts",
+    }
+    service = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.serve", "--port", str(port)],
+        cwd=Path(__file__).parent.parent,
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}{Settings.base_path}"
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if service.poll() is not None:
+            raise RuntimeError(f"Service exited with {service.returncode}")
+        try:
+            if httpx.get(f"{base_url}/health").status_code == 200:
+                return service, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    service.terminate()
+    raise RuntimeError(f"Service did not start within {timeout}s")
+
+
+def rss_mb(pid: int) -> float:
+    """Resident memory of a process and its children, like the image workers."""
+
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS"))
+        children = []
+        for path in glob.glob(f"/proc/{pid}/task/*/children"):
+            with open(path) as f:
+                children += [int(child) for child in f.read().split()]
+    except (OSError, StopIteration):
+        return 0
+    return rss / 1024 + sum(rss_mb(child) for child in children)
+
+
+def memory_budget_peak_mb(base_url: str) -> float:
+    text = httpx.get(f"{base_url}/metrics").text
+    for line in text.splitlines():
+        if line.startswith("promptly_memory_budget_peak "):
+            return float(line.split()[1]) / 1024 / 1024
+    return 0
+
+
+async def run_scenario(
+    name: str,
+    base_url: str,
+    stub_url: str,
+    requests: int,
+    concurrency: int,
+    offset: int = 0,
+    pid: int | None = None,
+) -> dict:
+    make_request = SCENARIOS[name]
+    latencies, errors = [], 0
+    indexes = iter(range(offset, offset + requests))
+    peak_rss = rss_mb(pid) if pid else 0
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while pid:
+            await asyncio.sleep(0.05)
+            peak_rss = max(peak_rss, rss_mb(pid))
+
+    async with httpx.AsyncClient(
+        base_url=base_url,
+        timeout=300,
+        limits=httpx.Limits(max_connections=concurrency),
+    ) as client:
+
+        async def worker():
+            nonlocal errors
+            for i in indexes:
+                path, payload = make_request(i, stub_url)
+                start = time.perf_counter()
+                try:
+                    response = await client.post(path, json=payload)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - start)
+                errors += not ok
+
+        sampler = asyncio.create_task(sample_rss())
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+        sampler.cancel()
+
+    return {
+        "scenario": name,
+        "requests": requests,
+        "errors": errors,
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "peak_rss_mb": round(peak_rss, 1),
+    }
+
+
+async def run(args) -> list[dict]:
+    stubs = start_stubs(args)
+    service, base_url = start_service(stubs.url)
+    rows = []
+    try:
+        for name in args.scenarios:
+            # warm up pools, clients and the prompt registry outside the numbers
+            await run_scenario(
+                name,
+                base_url,
+                stubs.url,
+                args.warmup,
+                args.concurrency,
+                offset=args.requests,
+            )
+            rows.append(
+                await run_scenario(
+                    name,
+                    base_url,
+                    stubs.url,
+                    args.requests,
+                    args.concurrency,
+                    pid=service.pid,
+                )
+            )
+        print(f"Memory budget peak: {memory_budget_peak_mb(base_url):0.1f} MB")
+    finally:
+        service.terminate()
+        service.wait(timeout=10)
+        stubs.stop()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--image-latency", type=float, default=0.02)
+    parser.add_argument("--save", help="write the latencies as a baseline")
+    parser.add_argument("--baseline", help="fail on regressions against a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    rows = asyncio.run(run(args))
+    print_table(rows, list(rows[0]))
+
+    results = {
+        f"{row['scenario']}.{q}": row[q]
+        for row in rows
+        for q in ("p50_ms", "p95_ms", "p99_ms")
+    }
+    if args.save:
+        save(results, args.save)
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Microbenchmarks of the message builders and response parsing.
+
+    python -m benchmarks.micro --save micro.json
+    python -m benchmarks.micro --baseline micro.json
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from tests.stubs import PROMPTS, make_image
+
+from .report import compare, print_table, save
+
+
+def bench(func, min_time: float = 0.5) -> tuple[int, float]:
+    """Calls made and microseconds per call, run for at least `min_time`."""
+
+    func()  # warm up lazy imports and caches
+    calls, start = 0, time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < min_time:
+        for _ in range(10):
+            func()
+        calls += 10
+    return calls, elapsed / calls * 1e6
+
+
+async def bench_async(func, min_time: float = 0.5) -> tuple[int, float]:
+    await func()
+    calls, start = 0, time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < min_time:
+        for _ in range(10):
+            await func()
+        calls += 10
+    return calls, elapsed / calls * 1e6
+
+
+async def run(min_time: float) -> list[dict]:
+    from apps.ai import services
+    from apps.ai.images import ImagePool, data_url
+    from apps.ai.prompts import PromptRegistry
+    from apps.ai.schemas import PromptTemplate
+
+    for key in ("stub_text", "stub_vision"):
+        PromptRegistry().set(PromptTemplate(**PROMPTS[key]))
+
+    system, user = "you are a product image validator", "validate " * 500
+    images = [make_image((512, 512)) for _ in range(3)]
+    image_urls = [data_url(image) for image in images]
+    answer = {"valid": True, "reasons": ["sharp", "white background"] * 10}
+    long_answer = {"items": [answer] * 200}
+    texts = {
+        "json": json.dumps(answer),
+        "json_fenced": f"Sure, here it is:\n```json\n{json.dumps(answer)}\n```",
+        "json_large": json.dumps(long_answer),
+        "plain_text": "The images look fine. " * 50,
+    }
+
+    sync_benches = {
+        "messages_openai": lambda: services.messages_openai(system, user, images),
+        "messages_openai_urls": lambda: services.messages_openai(
+            system, user, ["https://example.com/a.jpg"] * 3
+        ),
+        "messages_gemini": lambda: services.messages_gemini(system, user, images),
+        "build_messages": lambda: services.build_messages(
+            system, user, images, "gpt-4o-mini"
+        ),
+        **{
+            f"parse_{name}": lambda text=text: services.parse_answer(text)
+            for name, text in texts.items()
+        },
+        "parse_structured": lambda: services.parse_answer(texts["json"], True),
+        "parse_structured_large": lambda: services.parse_answer(
+            texts["json_large"], True
+        ),
+    }
+    async_benches = {
+        "make_messages_text": lambda: services.make_messages(
+            "stub_text", text="describe " * 200
+        ),
+        # data URLs skip the download and the cache, so every call encodes
+        "make_messages_vision": lambda: services.make_messages(
+            "stub_vision",
+            image_urls=image_urls,
+            summary="a product",
+        ),
+    }
+
+    rows = []
+    for name, func in sync_benches.items():
+        calls, us = bench(func, min_time)
+        rows.append({"benchmark": name, "calls": calls, "us_per_call": round(us, 1)})
+    ImagePool().start()
+    try:
+        for name, func in async_benches.items():
+            calls, us = await bench_async(func, min_time)
+            rows.append(
+                {"benchmark": name, "calls": calls, "us_per_call": round(us, 1)}
+            )
+    finally:
+        ImagePool().shutdown()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--min-time", type=float, default=0.5)
+    parser.add_argument("--save", help="write the timings as a baseline")
+    parser.add_argument("--baseline", help="fail on regressions against a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    rows = asyncio.run(run(args.min_time))
+    print_table(rows, ["benchmark", "calls", "us_per_call"])
+
+    results = {row["benchmark"]: row["us_per_call"] for row in rows}
+    if args.save:
+        save(results, args.save)
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
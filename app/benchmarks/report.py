@@ -0,0 +1,43 @@
+import json
+import math
+from pathlib import Path
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, math.ceil(q * len(values)) - 1)]
+
+
+def print_table(rows: list[dict], columns: list[str]):
+    widths = {
+        column: max(len(column), *(len(f"{row.get(column, '')}") for row in rows))
+        for column in columns
+    }
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for row in rows:
+        print(
+            "  ".join(
+                f"{row.get(column, '')}".ljust(widths[column]) for column in columns
+            )
+        )
+
+
+def compare(
+    results: dict[str, float], baseline_path: Path, tolerance: float
+) -> list[str]:
+    """Names of the results that are slower than the baseline by more than `tolerance`."""
+
+    baseline: dict[str, float] = json.loads(Path(baseline_path).read_text())
+    regressions = []
+    for name, value in results.items():
+        previous = baseline.get(name)
+        if previous and value > previous * (1 + tolerance):
+            regressions.append(name)
+            print(f"Regression: {name} {previous:0.2f} -> {value:0.2f}")
+    return regressions
+
+
+def save(results: dict[str, float], path: Path):
+    Path(path).write_text(json.dumps(results, indent=2))
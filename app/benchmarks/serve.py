@@ -0,0 +1,50 @@
+"""
+Service process of the load generator, without auth and the database.
+
+    python -m benchmarks.serve --port 8000
+"""
+
+import argparse
+import logging
+from contextlib import asynccontextmanager
+
+import uvicorn
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """The lifespan of `server.server` without the database."""
+
+    from apps.ai.engines import AIEngine, EngineCatalog
+    from apps.ai.images import ImageFetcher, ImagePool
+    from apps.ai.prompts import PromptRegistry
+
+    EngineCatalog().start()
+    await AIEngine.init_clients()
+    ImagePool().start()
+    await PromptRegistry().start()
+    yield
+    await PromptRegistry().stop()
+    ImagePool().shutdown()
+    await ImageFetcher().close()
+    await AIEngine.close_clients()
+    await EngineCatalog().stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    from apps.ai import routes
+    from server.server import app
+
+    routes.jwt_access_security = lambda request: None
+    app.router.lifespan_context = lifespan
+    logging.getLogger().setLevel(logging.WARNING)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,3 +17,89 @@ class Settings(config.Settings):
 
     STRAPI_URL: str = os.getenv("STRAPI_URL", "https://message.uln.me/api/prompts")
     STRAPI_TOKEN: str = os.getenv("STRAPI_TOKEN")
+    PROMPT_CACHE_TTL: int = int(os.getenv("PROMPT_CACHE_TTL", 10 * 60))
+    PROMPT_STALE_TTL: int = int(os.getenv("PROMPT_STALE_TTL", 24 * 3600))
+    PROMPT_SYNC_INTERVAL: int = int(os.getenv("PROMPT_SYNC_INTERVAL", 5 * 60))
+    PROMPT_SNAPSHOT_PATH: Path = Path(
+        os.getenv("PROMPT_SNAPSHOT_PATH", base_dir / "data" / "prompts.json")
+    )
+    STRAPI_WEBHOOK_TOKEN: str = os.getenv("STRAPI_WEBHOOK_TOKEN")
+
+    METIS_URL: str = os.getenv("METIS_URL", "https://api.metisai.ir")
+
+    AI_ENGINES_PATH: Path = Path(
+        os.getenv("AI_ENGINES_PATH", base_dir / "apps" / "ai" / "engines.json")
+    )
+    AI_ENGINES_RELOAD_INTERVAL: int = int(os.getenv("AI_ENGINES_RELOAD_INTERVAL", 30))
+    AI_ROUTER_WINDOW: float = float(os.getenv("AI_ROUTER_WINDOW", 300))
+    # about the 40,000 characters prompts were cut to before token budgets
+    AI_MAX_INPUT_TOKENS: int = int(os.getenv("AI_MAX_INPUT_TOKENS", 10_000))
+    AI_OUTPUT_TOKENS_ESTIMATE: int = int(os.getenv("AI_OUTPUT_TOKENS_ESTIMATE", 512))
+    AI_MAX_CONNECTIONS: int = int(os.getenv("AI_MAX_CONNECTIONS", 20))
+    AI_KEEPALIVE_EXPIRY: float = float(os.getenv("AI_KEEPALIVE_EXPIRY", 60))
+    AI_TIMEOUT: float = float(os.getenv("AI_TIMEOUT", 120))
+    AI_CONNECT_TIMEOUT: float = float(os.getenv("AI_CONNECT_TIMEOUT", 10))
+    AI_HTTP2: bool = os.getenv("AI_HTTP2", "true").lower() in ("true", "1", "yes")
+
+    AI_MAX_CONCURRENCY: int = int(
+        os.getenv("AI_MAX_CONCURRENCY", os.getenv("AI_MAX_CONNECTIONS", 20))
+    )
+    AI_RPM: float = float(os.getenv("AI_RPM", 0))
+    AI_TPM: float = float(os.getenv("AI_TPM", 0))
+    AI_LIMITS: str | None = os.getenv("AI_LIMITS")
+    AI_LIMIT_MAX_WAIT: float = float(os.getenv("AI_LIMIT_MAX_WAIT", 30))
+    AI_RATE_LIMIT_BACKOFF: float = float(os.getenv("AI_RATE_LIMIT_BACKOFF", 5))
+    AI_RETRY_ATTEMPTS: int = int(os.getenv("AI_RETRY_ATTEMPTS", 3))
+    AI_RETRY_BASE_DELAY: float = float(os.getenv("AI_RETRY_BASE_DELAY", 0.5))
+    AI_RETRY_MAX_DELAY: float = float(os.getenv("AI_RETRY_MAX_DELAY", 8))
+    AI_RETRIES: str | None = os.getenv("AI_RETRIES")
+    AI_RETRY_BUDGET_RATIO: float = float(os.getenv("AI_RETRY_BUDGET_RATIO", 0.2))
+    AI_RETRY_BUDGET_MAX: float = float(os.getenv("AI_RETRY_BUDGET_MAX", 20))
+    AI_BREAKER_THRESHOLD: int = int(os.getenv("AI_BREAKER_THRESHOLD", 5))
+    AI_BREAKER_RESET_TIMEOUT: float = float(os.getenv("AI_BREAKER_RESET_TIMEOUT", 30))
+
+    AI_BATCH_CONCURRENCY: int = int(os.getenv("AI_BATCH_CONCURRENCY", 8))
+    AI_BATCH_MAX_CONCURRENCY: int = int(os.getenv("AI_BATCH_MAX_CONCURRENCY", 32))
+    AI_BATCH_MAX_ITEMS: int = int(os.getenv("AI_BATCH_MAX_ITEMS", 1000))
+    AI_CACHE_MAX_BYTES: int = int(os.getenv("AI_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    AI_CACHE_DIR: str | None = os.getenv("AI_CACHE_DIR")
+    AI_CACHE_DISK_MAX_BYTES: int = int(
+        os.getenv("AI_CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024)
+    )
+    TRANSLATE_CACHE_TTL: int = int(os.getenv("TRANSLATE_CACHE_TTL", 7 * 24 * 3600))
+
+    IMAGE_CACHE_MAX_BYTES: int = int(
+        os.getenv("IMAGE_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+    )
+    IMAGE_CACHE_DIR: str | None = os.getenv("IMAGE_CACHE_DIR")
+    IMAGE_CACHE_DISK_MAX_BYTES: int = int(
+        os.getenv("IMAGE_CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024)
+    )
+    IMAGE_CACHE_TTL: int = int(os.getenv("IMAGE_CACHE_TTL", 7 * 24 * 3600))
+    IMAGE_CACHE_FRESH: int = int(os.getenv("IMAGE_CACHE_FRESH", 3600))
+
+    IMAGE_MAX_BYTES: int = int(os.getenv("IMAGE_MAX_BYTES", 10 * 1024 * 1024))
+    IMAGE_MAX_PIXELS: int = int(os.getenv("IMAGE_MAX_PIXELS", 50_000_000))
+    IMAGE_FETCH_TIMEOUT: float = float(os.getenv("IMAGE_FETCH_TIMEOUT", 10))
+    IMAGE_CONNECT_TIMEOUT: float = float(os.getenv("IMAGE_CONNECT_TIMEOUT", 3))
+    IMAGE_MAX_CONNECTIONS: int = int(os.getenv("IMAGE_MAX_CONNECTIONS", 64))
+    IMAGE_MAX_CONNECTIONS_PER_HOST: int = int(
+        os.getenv("IMAGE_MAX_CONNECTIONS_PER_HOST", 8)
+    )
+
+    IMAGE_MEMORY_ESTIMATE: int = int(
+        os.getenv("IMAGE_MEMORY_ESTIMATE", 16 * 1024 * 1024)
+    )
+    MEMORY_BUDGET_BYTES: int = int(os.getenv("MEMORY_BUDGET_BYTES", 384 * 1024 * 1024))
+    MEMORY_BUDGET_WAIT: float = float(os.getenv("MEMORY_BUDGET_WAIT", 10))
+
+    IMAGE_POOL: str = os.getenv("IMAGE_POOL", "process")
+    IMAGE_WORKERS: int = int(os.getenv("IMAGE_WORKERS", 0))
+    IMAGE_QUEUE_DEPTH: int = int(os.getenv("IMAGE_QUEUE_DEPTH", 64))
+
+    SERVER_TIMING: bool = os.getenv("SERVER_TIMING", "false").lower() in (
+        "true",
+        "1",
+        "yes",
+    )
+    TRACE_SAMPLE_RATE: float = float(os.getenv("TRACE_SAMPLE_RATE", 0))
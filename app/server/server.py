@@ -1,8 +1,40 @@
+from contextlib import asynccontextmanager
+
+import fastapi
 from fastapi_mongo_base.core import app_factory
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
+from apps.ai.engines import AIEngine, EngineCatalog
+from apps.ai.images import ImageFetcher, ImagePool
+from apps.ai.prompts import PromptRegistry
 from apps.ai.routes import router as ai_router
+from utils.timing import server_timing
 
 from . import config
 
-app = app_factory.create_app(settings=config.Settings(), serve_coverage=False)
+
+@asynccontextmanager
+async def lifespan(app: fastapi.FastAPI):
+    async with app_factory.lifespan(app, settings=config.Settings()):
+        EngineCatalog().start()
+        await AIEngine.init_clients()
+        ImagePool().start()
+        await PromptRegistry().start()
+        yield
+        await PromptRegistry().stop()
+        ImagePool().shutdown()
+        await ImageFetcher().close()
+        await AIEngine.close_clients()
+        await EngineCatalog().stop()
+
+
+app = app_factory.create_app(
+    settings=config.Settings(), serve_coverage=False, lifespan_func=lifespan
+)
 app.include_router(ai_router, prefix=config.Settings.base_path)
+app.middleware("http")(server_timing)
+
+
+@app.get(f"{config.Settings.base_path}/metrics", include_in_schema=False)
+async def metrics():
+    return fastapi.Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -34,3 +34,29 @@ async def client() -> AsyncGenerator[httpx.AsyncClient, None]:
         headers={"X-API-KEY": os.getenv("UFILES_API_KEY")},
     ) as ac:
         yield ac
+
+
+@pytest.fixture(scope="session")
+def stub_server():
+    from .stubs import StubServer, create_stub_app
+
+    server = StubServer(create_stub_app()).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def stub_env(stub_server, monkeypatch: pytest.MonkeyPatch):
+    """Point Strapi, the AI engines and auth at the local stub server."""
+
+    from apps.ai import routes
+    from apps.ai.engines import AIEngine
+
+    monkeypatch.setattr(Settings, "STRAPI_URL", f"{stub_server.url}/api/prompts")
+    monkeypatch.setattr(routes, "jwt_access_security", lambda request: None)
+    for engine in AIEngine.engines():
+        url = stub_server.url if engine.base_url == Settings.METIS_URL else None
+        monkeypatch.setattr(engine, "base_url", url or f"{stub_server.url}/openai/v1")
+        monkeypatch.setattr(engine, "api_key", "stub")
+        monkeypatch.setattr(engine, "_client", None)
+    return stub_server
@@ -0,0 +1,302 @@
+import asyncio
+import json
+import random
+import socket
+import threading
+import time
+from io import BytesIO
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from PIL import Image
+
+PROMPTS = {
+    "stub_vision": {
+        "key": "stub_vision",
+        "system": "you are a product image validator",
+        "user": "validate these images for {summary}",
+        "model_name": "gemini-2.0-flash",
+    },
+    "stub_text": {
+        "key": "stub_text",
+        "system": "you are a helpful assistant",
+        "user": "{text}",
+        "model_name": "gpt-4o-mini",
+    },
+    "stub_cached": {
+        "key": "stub_cached",
+        "system": "you are a helpful assistant",
+        "user": "{text}",
+        "model_name": "gpt-4o-mini",
+        "cache_ttl": 3600,
+    },
+    "stub_hedged": {
+        "key": "stub_hedged",
+        "system": "you are a helpful assistant",
+        "user": "{text}",
+        "model_name": "gpt-4o-mini",
+        "hedge_after": 200,
+        "hedge_model": "gpt-4o",
+    },
+    "stub_fallback": {
+        "key": "stub_fallback",
+        "system": "you are a helpful assistant",
+        "user": "{text}",
+        "model_name": "gemini-2.0-flash",
+        "fallback_models": "gpt-4o-mini",
+    },
+    "stub_budget": {
+        "key": "stub_budget",
+        "system": "you are a helpful assistant",
+        "user": "{text}",
+        "model_name": "gpt-4o",
+        "max_coins": 0.1,
+        "over_budget": "downgrade",
+        "downgrade_model": "gpt-4o-mini",
+    },
+    "stub_json": {
+        "key": "stub_json",
+        "system": "you are a helpful assistant",
+        "user": "{text}",
+        "model_name": "gpt-4o-mini",
+        "response_schema": '{"type": "object", "properties": {"ok": {"type": "boolean"}}}',
+    },
+}
+
+
+def closed_schema(schema) -> bool:
+    """OpenAI's strict mode rule: objects forbid extra keys and require all."""
+
+    if isinstance(schema, list):
+        return all(map(closed_schema, schema))
+    if not isinstance(schema, dict):
+        return True
+    if "properties" in schema and (
+        schema.get("additionalProperties") is not False
+        or sorted(schema.get("required", [])) != sorted(schema["properties"])
+    ):
+        return False
+    return all(map(closed_schema, schema.values()))
+
+
+def make_image(size=(800, 800), color=(200, 120, 40)) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def create_stub_app(
+    latency: float = 0.5,
+    *,
+    jitter: float = 0,
+    error_rate: float = 0,
+    answer: dict | None = None,
+) -> FastAPI:
+    """
+    Local stand-in for Strapi, an image host and the Gemini/OpenAI APIs.
+
+    Provider calls take `latency` plus up to `jitter` seconds and fail with a
+    503 at `error_rate`, or always for models in `app.state.failing_models`.
+    """
+
+    app = FastAPI()
+    app.state.latency = latency
+    app.state.jitter = jitter
+    app.state.error_rate = error_rate
+    app.state.calls = 0
+    app.state.in_flight = 0
+    app.state.max_in_flight = 0
+    app.state.model_latency = {}
+    app.state.failing_models = set()
+    app.state.image = make_image()
+
+    @app.get("/api/prompts")
+    async def prompts(request: Request):
+        params = request.query_params
+        key = params.get("filters[key][$eq]")
+        if key:
+            data = [PROMPTS[key]] if key in PROMPTS else []
+        else:
+            data = list(PROMPTS.values())
+
+        page = int(params.get("pagination[page]", 1))
+        page_size = int(params.get("pagination[pageSize]", 25))
+        page_count = max(1, -(-len(data) // page_size))
+        data = data[(page - 1) * page_size : page * page_size]
+        return {
+            "data": [{"id": i, "attributes": d} for i, d in enumerate(data)],
+            "meta": {"pagination": {"page": page, "pageCount": page_count}},
+        }
+
+    app.state.image_requests = 0
+    app.state.image_latency = 0
+
+    @app.get("/images/{name}")
+    async def images(name: str, request: Request):
+        app.state.image_requests += 1
+        await asyncio.sleep(app.state.image_latency)
+        etag = f'"{name}-{hash(app.state.image)}"'
+        if request.headers.get("If-None-Match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return Response(
+            app.state.image, media_type="image/jpeg", headers={"ETag": etag}
+        )
+
+    answer = json.dumps(answer or {"ok": True})
+    pieces = [answer[i : i + 4] for i in range(0, len(answer), 4)]
+
+    def sse(events: list[dict], done: bool = False):
+        async def stream():
+            await provider_latency()
+            for event in events:
+                yield f"data: {json.dumps(event)}\n\n"
+            if done:
+                yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    async def provider_latency(model: str | None = None):
+        app.state.calls += 1
+        app.state.in_flight += 1
+        app.state.max_in_flight = max(app.state.max_in_flight, app.state.in_flight)
+        try:
+            latency = app.state.model_latency.get(model, app.state.latency)
+            await asyncio.sleep(latency + random.uniform(0, app.state.jitter))
+        finally:
+            app.state.in_flight -= 1
+
+    def unavailable(model: str) -> Response | None:
+        if model in app.state.failing_models or random.random() < app.state.error_rate:
+            error = {"code": 503, "message": "overloaded", "status": "UNAVAILABLE"}
+            return JSONResponse({"error": error}, status_code=503)
+
+    @app.post("/v1beta/models/{model}:generateContent")
+    async def gemini(model: str, request: Request):
+        if response := unavailable(model):
+            return response
+        app.state.generation_config = (await request.json()).get("generationConfig")
+        await provider_latency(model)
+        return {
+            "candidates": [
+                {
+                    "content": {"role": "model", "parts": [{"text": answer}]},
+                    "finishReason": "STOP",
+                }
+            ],
+            "usageMetadata": {"promptTokenCount": 100, "candidatesTokenCount": 10},
+        }
+
+    @app.post("/v1beta/models/{model}:streamGenerateContent")
+    async def gemini_stream(model: str, request: Request):
+        events = [
+            {"candidates": [{"content": {"role": "model", "parts": [{"text": piece}]}}]}
+            for piece in pieces
+        ]
+        events[-1]["usageMetadata"] = {
+            "promptTokenCount": 100,
+            "candidatesTokenCount": 10,
+        }
+        return sse(events)
+
+    @app.post("/openai/v1/chat/completions")
+    async def openai(request: Request):
+        body = await request.json()
+        image_urls = [
+            part["image_url"]["url"]
+            for message in body["messages"]
+            if isinstance(message["content"], list)
+            for part in message["content"]
+            if part["type"] == "image_url"
+        ]
+        app.state.image_urls = image_urls
+        app.state.response_format = body.get("response_format")
+        json_schema = (body.get("response_format") or {}).get("json_schema", {})
+        if json_schema.get("strict") and not closed_schema(json_schema["schema"]):
+            error = {"message": "Invalid schema for strict mode", "code": None}
+            return JSONResponse({"error": error}, status_code=400)
+        if any("unreachable" in url for url in image_urls):
+            error = {
+                "message": "Error while downloading image",
+                "code": "invalid_image_url",
+            }
+            return JSONResponse({"error": error}, status_code=400)
+        if body.get("stream"):
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model"),
+            }
+            events = [
+                chunk | {"choices": [{"index": 0, "delta": {"content": piece}}]}
+                for piece in pieces
+            ]
+            events.append(
+                chunk
+                | {
+                    "choices": [],
+                    "usage": {
+                        "prompt_tokens": 100,
+                        "completion_tokens": 10,
+                        "total_tokens": 110,
+                    },
+                }
+            )
+            return sse(events, done=True)
+
+        if response := unavailable(body.get("model")):
+            return response
+        await provider_latency(body.get("model"))
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {
+                        "role": "assistant",
+                        "content": answer,
+                    },
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": 100,
+                "completion_tokens": 10,
+                "total_tokens": 110,
+            },
+        }
+
+    return app
+
+
+class StubServer:
+    def __init__(self, app: FastAPI, host: str = "127.0.0.1", **config):
+        self.app = app
+        self.host = host
+        with socket.socket() as sock:
+            sock.bind((host, 0))
+            self.port = sock.getsockname()[1]
+        self.server = uvicorn.Server(
+            uvicorn.Config(
+                app, host=host, port=self.port, log_level="warning", **config
+            )
+        )
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join()
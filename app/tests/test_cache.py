@@ -0,0 +1,106 @@
+from io import BytesIO
+
+import httpx
+import pytest
+from PIL import Image
+
+from server.config import Settings
+
+
+@pytest.mark.asyncio
+async def test_response_cache(client: httpx.AsyncClient, settings: Settings, stub_env):
+    calls = stub_env.app.state.calls
+
+    async def call(text: str):
+        response = await client.post(
+            f"{settings.base_path}/ai/stub_cached", json={"text": text}
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    first = await call("same catalog item")
+    assert first["ok"] is True
+    assert first["coins"] > 0
+    assert "cached" not in first
+
+    second = await call("same catalog item")
+    assert second == first | {"coins": 0, "cached": True}
+    assert stub_env.app.state.calls == calls + 1
+
+    await call("another catalog item")
+    assert stub_env.app.state.calls == calls + 2
+
+
+def test_lru_cache_byte_budget():
+    from utils.cache import LRUCache
+
+    cache = LRUCache(max_bytes=10)
+    cache.set("a", "aaaa", ttl=60, size=4)
+    cache.set("b", "bbbb", ttl=60, size=4)
+    assert cache.get("a") == "aaaa"
+    cache.set("c", "cccc", ttl=60, size=4)
+    assert cache.get("b") is None
+    assert cache.get("a") == "aaaa"
+    assert cache.size == 8
+
+    cache.set("expired", "x", ttl=-1, size=1)
+    assert cache.get("expired") is None
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_disk(tmp_path):
+    from utils.cache import TieredCache
+
+    cache = TieredCache(max_bytes=1024, directory=tmp_path)
+    await cache.set("key", {"answer": 42, "data": b"\xff\xd8"}, ttl=60)
+
+    restarted = TieredCache(max_bytes=1024, directory=tmp_path)
+    assert await restarted.get("key") == {"answer": 42, "data": b"\xff\xd8"}
+    assert restarted.memory.get("key") == {"answer": 42, "data": b"\xff\xd8"}
+
+
+@pytest.mark.asyncio
+async def test_disk_cache_sweep(tmp_path):
+    from utils.cache import DiskCache
+
+    cache = DiskCache(tmp_path, sweep_interval=3600)
+    await cache.set("expired", "x" * 100, ttl=-1)
+    for ttl in (30, 60, 90):
+        await cache.set(f"key{ttl}", "x" * 100, ttl=ttl)
+    await cache.sweeping
+
+    assert not cache.path("expired").exists()
+    value, expires_at = await cache.get("key30")
+    assert value == "x" * 100
+    assert cache.path("key30").stat().st_mtime == pytest.approx(expires_at)
+
+    cache.max_bytes = 2 * cache.path("key90").stat().st_size
+    assert cache.sweep() == 1
+    assert not cache.path("key30").exists()
+    assert cache.path("key60").exists() and cache.path("key90").exists()
+
+
+@pytest.mark.asyncio
+async def test_image_cache_revalidation(stub_env, monkeypatch):
+    from apps.ai import images
+
+    url = f"{stub_env.url}/images/revalidate.jpg"
+    requests = stub_env.app.state.image_requests
+
+    first = await images.get_encoded_image(url)
+    assert await images.get_encoded_image(url) == first
+    assert stub_env.app.state.image_requests == requests + 1
+
+    monkeypatch.setattr(Settings, "IMAGE_CACHE_FRESH", -1)
+    assert await images.get_encoded_image(url) == first
+    assert stub_env.app.state.image_requests == requests + 2
+
+    await images.get_encoded_image(url, max_size_kb=50)
+    assert stub_env.app.state.image_requests == requests + 3
+
+    # a changed image is encoded from the revalidation response
+    changed = BytesIO()
+    Image.new("RGB", (64, 64), "blue").save(changed, "JPEG")
+    monkeypatch.setattr(stub_env.app.state, "image", changed.getvalue())
+    assert await images.get_encoded_image(url) != first
+    assert stub_env.app.state.image_requests == requests + 4
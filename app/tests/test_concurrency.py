@@ -0,0 +1,175 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from server.config import Settings
+
+
+@pytest.mark.asyncio
+async def test_parallel_gemini_vision(
+    client: httpx.AsyncClient, settings: Settings, stub_env, monkeypatch
+):
+    """Gemini calls must not block the event loop while waiting on the provider."""
+
+    count = 8
+    latency = 1.0
+    monkeypatch.setattr(stub_env.app.state, "latency", latency)
+    stub_env.app.state.max_in_flight = 0
+
+    async def call(i: int):
+        return await client.post(
+            f"{settings.base_path}/ai/vision/stub_vision",
+            json={
+                "image_urls": [f"{stub_env.url}/images/{i}.jpg"],
+                "data": {"summary": f"product {i}"},
+            },
+        )
+
+    start = time.perf_counter()
+    responses = await asyncio.gather(*[call(i) for i in range(count)])
+    elapsed = time.perf_counter() - start
+
+    for response in responses:
+        assert response.status_code == 200
+        assert response.json()["ok"] is True
+    assert stub_env.app.state.max_in_flight == count
+    assert elapsed < latency * count / 2
+
+
+@pytest.mark.asyncio
+async def test_identical_requests_coalesce(
+    client: httpx.AsyncClient, settings: Settings, stub_env
+):
+    calls = stub_env.app.state.calls
+    payload = {
+        "image_urls": [f"{stub_env.url}/images/same.jpg"],
+        "data": {"summary": "same product"},
+    }
+
+    responses = await asyncio.gather(
+        *[
+            client.post(f"{settings.base_path}/ai/vision/stub_vision", json=payload)
+            for _ in range(5)
+        ]
+    )
+
+    assert [r.status_code for r in responses] == [200] * 5
+    assert all(r.json() == responses[0].json() for r in responses)
+    assert stub_env.app.state.calls == calls + 1
+
+
+@pytest.mark.asyncio
+async def test_singleflight_cancels_when_all_callers_leave():
+    from utils.singleflight import SingleFlight
+
+    flights, started, cancelled = SingleFlight(), asyncio.Event(), asyncio.Event()
+
+    async def work():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    callers = [asyncio.create_task(flights.do("key", work)) for _ in range(2)]
+    await started.wait()
+    callers[0].cancel()
+    await asyncio.sleep(0.01)
+    assert not cancelled.is_set() and len(flights) == 1
+
+    callers[1].cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
+    assert len(flights) == 0 and not flights.waiters
+
+
+@pytest.mark.asyncio
+async def test_image_pool_encodes_in_parallel(stub_env):
+    from apps.ai import images
+
+    pool = images.ImagePool()
+    completed = pool.stats()["completed"]
+    urls = [f"{stub_env.url}/images/pool-{i}.jpg" for i in range(4)]
+
+    encoded = await asyncio.gather(*[images.get_encoded_image(url) for url in urls])
+
+    assert len(set(encoded)) == 1
+    assert pool.stats()["completed"] == completed + len(urls)
+    assert pool.stats()["active"] == 0
+
+    # every worker is busy at once and the event loop keeps running meanwhile
+    max_active, ticks = 0, 0
+
+    async def watch():
+        nonlocal max_active, ticks
+        while True:
+            max_active = max(max_active, pool.stats()["active"])
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    watcher = asyncio.create_task(watch())
+    jobs = pool.workers * 2
+    start = time.perf_counter()
+    await asyncio.gather(*[pool.run(time.sleep, 0.2) for _ in range(jobs)])
+    elapsed = time.perf_counter() - start
+    watcher.cancel()
+
+    assert max_active == pool.workers
+    assert ticks >= 20
+    assert elapsed < 0.2 * (jobs / pool.workers + 1)
+
+
+@pytest.mark.asyncio
+async def test_image_pool_recovers_from_dead_worker():
+    import os
+    from concurrent.futures import BrokenExecutor
+
+    from apps.ai import images
+
+    pool = images.ImagePool()
+    if pool.kind != "process":
+        pytest.skip("only process pools break")
+    # a worker killed like by the OOM killer breaks only the jobs it had
+    with pytest.raises(BrokenExecutor):
+        await pool.run(os._exit, 1)
+    assert await pool.run(abs, -1) == 1
+
+
+@pytest.mark.asyncio
+async def test_batch_ndjson(client: httpx.AsyncClient, settings: Settings, stub_env):
+    items = [{"data": {"text": f"batch item {i}"}} for i in range(5)]
+    items.append({"image_urls": [f"{stub_env.url}/missing"], "data": {"text": "x"}})
+
+    async with client.stream(
+        "POST",
+        f"{settings.base_path}/ai/batch/stub_text",
+        json={"items": items, "concurrency": 3},
+    ) as response:
+        assert response.status_code == 200
+        lines = [json.loads(line) async for line in response.aiter_lines() if line]
+
+    summary = lines.pop()
+    assert summary["done"] is True
+    assert summary["count"] == 6
+    assert summary["errors"] == 1
+    assert sorted(line["index"] for line in lines) == list(range(6))
+    assert "error" in next(line for line in lines if line["index"] == 5)
+    assert summary["coins"] == pytest.approx(
+        sum(line["result"]["coins"] for line in lines if "result" in line)
+    )
+
+
+@pytest.mark.asyncio
+async def test_batch_rejects_invalid_requests(
+    client: httpx.AsyncClient, settings: Settings, stub_env
+):
+    url = f"{settings.base_path}/ai/batch/stub_text"
+    response = await client.post(url, json={"items": [{}], "concurrency": 0})
+    assert response.status_code == 422
+
+    items = [{}] * (Settings.AI_BATCH_MAX_ITEMS + 1)
+    response = await client.post(url, json={"items": items})
+    assert response.status_code == 422
@@ -1,3 +1,5 @@
+import asyncio
+
 import httpx
 import pytest
 
@@ -10,3 +12,59 @@ async def test_health(client: httpx.AsyncClient, settings: Settings):
     response = await client.get(f"{settings.base_path}/health")
     assert response.status_code == 200
     assert response.json().get("status") == "up"
+
+
+@pytest.mark.asyncio
+async def test_metrics(client: httpx.AsyncClient, settings: Settings, stub_env):
+    response = await client.post(
+        f"{settings.base_path}/ai/stub_text", json={"text": "count me"}
+    )
+    assert response.status_code == 200
+
+    response = await client.get(f"{settings.base_path}/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'promptly_request_seconds_count{key="stub_text"' in text
+    assert 'promptly_provider_seconds_count{key="stub_text"' in text
+    assert 'promptly_tokens_total{key="stub_text"' in text
+    assert 'promptly_requests_in_flight{key="stub_text"} 0.0' in text
+    assert "promptly_memory_budget_used" in text
+    assert "promptly_engine_in_flight" in text
+
+
+@pytest.mark.asyncio
+async def test_metrics_unknown_key(
+    client: httpx.AsyncClient, settings: Settings, stub_env
+):
+    response = await client.post(
+        f"{settings.base_path}/ai/stub_missing", json={"text": "who am i"}
+    )
+    assert response.status_code != 200
+
+    response = await client.get(f"{settings.base_path}/metrics")
+    assert "stub_missing" not in response.text
+    assert 'promptly_request_seconds_count{key="unknown"' in response.text
+
+
+@pytest.mark.asyncio
+async def test_server_timing(
+    client: httpx.AsyncClient, settings: Settings, stub_env, monkeypatch
+):
+    url = f"{settings.base_path}/ai/stub_text"
+    response = await client.post(url, json={"text": "untimed"})
+    assert "Server-Timing" not in response.headers
+
+    monkeypatch.setattr(Settings, "SERVER_TIMING", True)
+    # identical requests share one provider call, both report its stages
+    responses = await asyncio.gather(
+        *[client.post(url, json={"text": "time me"}) for _ in range(2)]
+    )
+    for response in responses:
+        assert response.status_code == 200
+        stages = dict(
+            part.split(";dur=")
+            for part in response.headers["Server-Timing"].split(", ")
+        )
+        assert {"prompt", "messages", "provider", "total"} <= stages.keys()
+        assert float(stages["provider"]) <= float(stages["total"])
@@ -0,0 +1,138 @@
+import httpx
+import openai
+import pytest
+
+from apps.ai.engines import AIEngine
+from apps.ai.retries import CircuitBreaker, RetryPolicy
+from server.config import Settings
+from tests.stubs import make_image
+
+
+@pytest.mark.asyncio
+async def test_image_url_passthrough(
+    client: httpx.AsyncClient, settings: Settings, stub_env, monkeypatch
+):
+    async def call(image_url: str):
+        response = await client.post(
+            f"{settings.base_path}/ai/vision/stub_text",
+            json={
+                "image_urls": [image_url],
+                "data": {"text": image_url, "image_mode": "url"},
+            },
+        )
+        assert response.status_code == 200
+        return stub_env.app.state.image_urls
+
+    reachable = f"{stub_env.url}/images/passthrough.jpg"
+    assert await call(reachable) == [reachable]
+
+    unreachable = f"{stub_env.url}/images/unreachable.jpg"
+    sent = await call(unreachable)
+    assert sent[0].startswith("data:image/jpeg;base64,")
+
+    # outages are retried with the URLs and counted by the breaker, not inlined
+    engine = AIEngine.get_by_name("gpt-4o-mini")
+    breaker = CircuitBreaker(engine.name)
+    monkeypatch.setattr(engine, "_retry_policy", RetryPolicy(2, 0.01, 0.01))
+    monkeypatch.setattr(engine, "_breaker", breaker)
+    monkeypatch.setattr(stub_env.app.state, "failing_models", {"gpt-4o-mini"})
+    image_requests = stub_env.app.state.image_requests
+    with pytest.raises(openai.InternalServerError):
+        await client.post(
+            f"{settings.base_path}/ai/vision/stub_text",
+            json={
+                "image_urls": [reachable],
+                "data": {"text": "outage", "image_mode": "url"},
+            },
+        )
+    assert breaker.failures == 2
+    assert stub_env.app.state.image_requests == image_requests
+
+
+def test_fit_size():
+    from apps.ai.images import fit_size
+
+    assert fit_size(800, 600, max_side=512) == (512, 384)
+    assert fit_size(300, 200, max_side=512) == (300, 200)
+    # 2048x1536 -> 1024x768 is 2x2 tiles, the 5% shrink to 972x729 is not enough
+    assert fit_size(2048, 1536, max_side=2048, short_side=768, tile=512) == (1024, 768)
+    # 1100 wide needs 3 tiles, 1024 fits in 2 at 93% of the resolution
+    assert fit_size(1100, 500, max_side=2048, short_side=768, tile=512) == (1024, 465)
+
+
+@pytest.mark.asyncio
+async def test_model_aware_image_size(stub_env):
+    from io import BytesIO
+
+    from PIL import Image
+
+    from apps.ai import services
+
+    url = f"{stub_env.url}/images/sized.jpg"
+    (openai_low,) = await services.encode_images([url], "gpt-4o-mini")
+    (gemini,) = await services.encode_images([url], "gemini-2.0-flash")
+
+    assert Image.open(BytesIO(openai_low)).size == (512, 512)
+    assert Image.open(BytesIO(gemini)).size == (768, 768)
+
+
+@pytest.mark.asyncio
+async def test_image_mime_type_follows_format(stub_env, monkeypatch):
+    from apps.ai import services
+    from apps.ai.engines import AIEngine
+
+    engine = AIEngine.get_by_name("gpt-4o-mini")
+    image_params = engine.image_params
+    monkeypatch.setattr(
+        engine,
+        "image_params",
+        lambda low_res=True: image_params(low_res) | {"format": "PNG"},
+    )
+    url = f"{stub_env.url}/images/format.jpg"
+    encoded = await services.encode_images([url], "gpt-4o-mini")
+    messages = services.build_messages("system", "user", encoded, "gpt-4o-mini")
+    image_url = messages[1]["content"][1]["image_url"]["url"]
+    assert image_url.startswith("data:image/png;base64,iVBORw0KGgo")
+
+
+def test_jpeg_decodes_at_reduced_scale():
+    from apps.ai import images
+
+    content = make_image((4000, 3000))
+    full = 4000 * 3000 * 3
+    assert images.decoded_bytes(content) > 2 * full
+    # JPEG draft decodes at 1/4 scale when the target is 1000px or less
+    assert images.decoded_bytes(content, max_side=1000) < 2 * full / 10
+    encoded = images.encode_image_bytes(content, None, max_side=1000)
+    assert images.open_image(encoded).size == (1000, 750)
+
+
+@pytest.mark.asyncio
+async def test_image_fetch_limits(stub_env, monkeypatch):
+    from fastapi_mongo_base.core import exceptions
+
+    from apps.ai import images
+
+    fetcher = images.ImageFetcher()
+    url = f"{stub_env.url}/images/limits.jpg"
+    response, content = await images.fetch_image(url)
+    assert response.status_code == 200 and content
+
+    monkeypatch.setattr(fetcher, "max_bytes", 1000)
+    with pytest.raises(exceptions.BaseHTTPException) as e:
+        await images.fetch_image(url)
+    assert e.value.status_code == 413
+
+    monkeypatch.setattr(fetcher, "max_bytes", Settings.IMAGE_MAX_BYTES)
+    monkeypatch.setattr(fetcher, "max_pixels", 100 * 100)
+    with pytest.raises(exceptions.BaseHTTPException) as e:
+        await images.fetch_image(url)
+    assert e.value.status_code == 413
+
+    # images smaller than the header window are checked once complete
+    monkeypatch.setattr(stub_env.app.state, "image", make_image((40, 40)))
+    assert len(stub_env.app.state.image) < 1024
+    monkeypatch.setattr(fetcher, "max_pixels", 30 * 30)
+    with pytest.raises(exceptions.BaseHTTPException) as e:
+        await images.fetch_image(f"{stub_env.url}/images/tiny.jpg")
+    assert e.value.status_code == 413
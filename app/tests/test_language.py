@@ -0,0 +1,37 @@
+import pytest
+from fastapi_mongo_base.core.enums import Language
+
+from apps.ai import services
+from utils.language import detect_language, from_code
+
+
+@pytest.mark.parametrize(
+    "text, language",
+    [
+        ("سلام، این یک متن فارسی برای آزمایش است", Language.Persian),
+        ("مرحبا، كيف حالك يا صديقي؟ هذه مدينة جميلة", Language.Arabic),
+        ("This is a short product description for the shop", Language.English),
+        ("Ceci est une description du produit pour la boutique", Language.French),
+        ("Das ist nicht gut und ich bin müde", Language.German),
+        ("Привет, как дела? Мы были там вчера", Language.Russian),
+        ("こんにちは、元気ですか", Language.Japanese),
+    ],
+)
+def test_detect_language(text: str, language: Language):
+    assert detect_language(text) == language
+
+
+def test_from_code():
+    assert from_code("fa") == Language.Persian
+    assert from_code("en-US") == Language.English
+    assert from_code("xx") is None
+
+
+@pytest.mark.asyncio
+async def test_translate_same_language_skips_llm(monkeypatch):
+    async def fail(*args, **kwargs):
+        raise AssertionError("the LLM must not be called")
+
+    monkeypatch.setattr(services, "answer_with_ai", fail)
+    result = await services.translate("سلام دنیا، حال شما چطور است", "Persian")
+    assert result == {"translated_text": "سلام دنیا، حال شما چطور است", "coins": 0}
@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import pytest
+from fastapi_mongo_base.core import exceptions
+
+from apps.ai.limits import EngineLimiter
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after: float):
+        self.response = type("Response", (), {"headers": {"retry-after": retry_after}})
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit_rejects_after_max_wait():
+    limiter = EngineLimiter("stub", concurrency=2, max_wait=0.2)
+
+    async def call():
+        async with limiter.limit():
+            await asyncio.sleep(0.5)
+
+    results = await asyncio.gather(*[call() for _ in range(3)], return_exceptions=True)
+
+    rejected = [r for r in results if isinstance(r, exceptions.BaseHTTPException)]
+    assert len(rejected) == 1
+    assert rejected[0].status_code == 503
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_pauses_engine():
+    limiter = EngineLimiter("stub", rpm=60, max_wait=5)
+
+    with pytest.raises(RateLimitError):
+        async with limiter.limit():
+            raise RateLimitError(retry_after=0.3)
+    assert limiter.requests.capacity == 30
+
+    start = time.perf_counter()
+    async with limiter.limit():
+        pass
+    assert time.perf_counter() - start >= 0.25
+
+    limiter.max_wait = 0.1
+    limiter.record_rate_limit(1)
+    with pytest.raises(exceptions.BaseHTTPException):
+        async with limiter.limit():
+            pass
+
+
+@pytest.mark.asyncio
+async def test_memory_budget_queues_then_rejects(monkeypatch):
+    from apps.ai.memory import MemoryBudget
+
+    budget = MemoryBudget()
+    monkeypatch.setattr(budget, "capacity", 100)
+    monkeypatch.setattr(budget, "max_wait", 0.2)
+    monkeypatch.setattr(budget, "peak", 0)
+    rejected = budget.rejected
+    order = []
+
+    async def request(name: str, size: int, hold: float):
+        async with budget.reserve(size):
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    first = asyncio.create_task(request("first", 80, 0.1))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(request("second", 50, 0))
+    third = asyncio.create_task(request("third", 10, 0))
+    await asyncio.gather(first, second, third)
+    # FIFO: the small request does not overtake the waiting large one
+    assert order == ["first", "second", "third"]
+    assert budget.used == 0 and budget.peak == 80
+
+    blocker = asyncio.create_task(request("blocker", 100, 0.5))
+    await asyncio.sleep(0)
+    with pytest.raises(exceptions.BaseHTTPException) as e:
+        await request("late", 10, 0)
+    assert e.value.status_code == 503
+    await blocker
+    assert budget.rejected == rejected + 1 and budget.used == 0
+
+    # without waiting, an oversized request still runs alone on an idle budget
+    monkeypatch.setattr(budget, "max_wait", 0)
+    async with budget.reserve(500) as reserved:
+        assert reserved.size == 100
+        reserved.shrink(30)
+        assert budget.used == 30
+    assert budget.used == 0
+
+    # work of admitted requests goes ahead of requests waiting for admission
+    monkeypatch.setattr(budget, "max_wait", 0.2)
+    async with budget.reserve(80):
+        waiting = asyncio.create_task(request("waiting", 50, 0))
+        await asyncio.sleep(0)
+        async with budget.reserve(10, ahead=True):
+            assert budget.used == 90
+    await waiting
@@ -41,3 +41,78 @@ async def test_prompt(client: httpx.AsyncClient, settings: Settings):
     )
     logging.info(response.json())
     assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_prompt_cache_stale_while_revalidate(stub_env):
+    import asyncio
+
+    from apps.ai.prompts import PromptRegistry
+    from apps.ai.services import get_prompt
+
+    cache = PromptRegistry()
+    cache.invalidate()
+    system, user, model_name = await get_prompt("stub_text", text="first")
+    assert user == "first"
+    assert model_name == "gpt-4o-mini"
+    assert cache.entries["stub_text"][1].format_keys == {"text"}
+
+    fetched_at, template = cache.entries["stub_text"]
+    cache.entries["stub_text"] = (fetched_at - cache.ttl - 1, template)
+    system, user, _ = await get_prompt("stub_text", text="second")
+    assert user == "second"
+    assert "stub_text" in cache.refreshing
+
+    await asyncio.gather(*cache.refreshing.values())
+    assert cache.entries["stub_text"][0] > fetched_at
+
+
+@pytest.mark.asyncio
+async def test_prompt_registry_preload(
+    client: httpx.AsyncClient, settings: Settings, stub_env, tmp_path, monkeypatch
+):
+    from apps.ai.prompts import PromptRegistry
+    from utils import messages
+
+    from .stubs import PROMPTS
+
+    monkeypatch.setattr(Settings, "PROMPT_SNAPSHOT_PATH", tmp_path / "prompts.json")
+    assert len(await messages.get_all_prompts(page_size=1)) == len(PROMPTS)
+
+    registry = PromptRegistry()
+    registry.invalidate()
+    assert await registry.sync(full=True) == len(PROMPTS)
+    assert (tmp_path / "prompts.json").exists()
+
+    registry.invalidate()
+    assert await registry.load_snapshot() == len(PROMPTS)
+    assert [p.key for p in registry.search(["stub_", "c"])] == [
+        "stub_cached",
+        "stub_fallback",
+    ]
+
+    response = await client.get(f"{settings.base_path}/ai/", params={"key": "vision"})
+    assert response.status_code == 200
+    assert [p["key"] for p in response.json()] == ["stub_vision"]
+
+    response = await client.get(f"{settings.base_path}/ai/stub_text/fields")
+    assert response.json() == ["text"]
+
+    url = f"{settings.base_path}/ai/prompts/webhook"
+    event = {"event": "entry.delete", "model": "prompt", "entry": {"key": "stub_text"}}
+    monkeypatch.setattr(Settings, "STRAPI_WEBHOOK_TOKEN", None)
+    response = await client.post(url, json=event)
+    assert response.status_code == 401
+
+    monkeypatch.setattr(Settings, "STRAPI_WEBHOOK_TOKEN", "secret")
+    response = await client.post(
+        url, json=event, headers={"Authorization": "Bearer wrong"}
+    )
+    assert response.status_code == 401
+    assert "stub_text" in registry.entries
+
+    response = await client.post(
+        url, json=event, headers={"Authorization": "Bearer secret"}
+    )
+    assert response.status_code == 200
+    assert "stub_text" not in registry.entries
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+from fastapi_mongo_base.core import exceptions
+
+from apps.ai.retries import CircuitBreaker, RetryBudget, RetryPolicy, call_with_retries
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def failing(*status_codes: int):
+    calls = []
+
+    async def call():
+        calls.append(1)
+        if len(calls) <= len(status_codes):
+            raise ProviderError(status_codes[len(calls) - 1])
+        return "ok"
+
+    return call, calls
+
+
+def retry_kwargs(**kwargs):
+    return {
+        "policy": RetryPolicy(attempts=3, base_delay=0.01, max_delay=0.01),
+        "breaker": CircuitBreaker("stub", threshold=3, reset_timeout=0.2),
+        "budget": RetryBudget(ratio=0.2, capacity=10),
+    } | kwargs
+
+
+@pytest.mark.asyncio
+async def test_retries_only_transient_errors():
+    call, calls = failing(503, 429)
+    assert await call_with_retries(call, **retry_kwargs()) == "ok"
+    assert len(calls) == 3
+
+    call, calls = failing(400)
+    with pytest.raises(ProviderError):
+        await call_with_retries(call, **retry_kwargs())
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_retry_budget_limits_retries():
+    budget = RetryBudget(ratio=0, capacity=1)
+    call, calls = failing(500, 500, 500)
+    with pytest.raises(ProviderError):
+        await call_with_retries(call, **retry_kwargs(budget=budget))
+    assert len(calls) == 2
+    assert budget.exhausted == 1
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_fails_fast():
+    kwargs = retry_kwargs()
+    call, calls = failing(500, 500, 500)
+    with pytest.raises(ProviderError):
+        await call_with_retries(call, **kwargs)
+    assert kwargs["breaker"].state == "open"
+
+    with pytest.raises(exceptions.BaseHTTPException) as e:
+        await call_with_retries(call, **kwargs)
+    assert e.value.status_code == 503
+    assert len(calls) == 3
+
+    await asyncio.sleep(0.2)
+    assert kwargs["breaker"].state == "half_open"
+    assert await call_with_retries(call, **kwargs) == "ok"
+    assert kwargs["breaker"].state == "closed"
+
+
+def test_sdk_retries_disabled():
+    from apps.ai.engines import AIEngine
+
+    # the SDK would retry inside RetryPolicy, hidden from budget and breaker
+    engine = AIEngine("stub", "stub", "http://127.0.0.1/openai/v1")
+    assert engine.create_client().max_retries == 0
+
+
+@pytest.mark.asyncio
+async def test_rate_limits_do_not_open_breaker():
+    kwargs = retry_kwargs(breaker=CircuitBreaker("stub", threshold=2))
+    call, calls = failing(429, 429, 429)
+    with pytest.raises(ProviderError):
+        await call_with_retries(call, **kwargs)
+    assert kwargs["breaker"].state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_probe_is_released():
+    kwargs = retry_kwargs()
+    call, _ = failing(500, 500, 500)
+    with pytest.raises(ProviderError):
+        await call_with_retries(call, **kwargs)
+    await asyncio.sleep(0.2)
+    assert kwargs["breaker"].state == "half_open"
+
+    call, _ = failing(429)
+    single = kwargs | {"policy": RetryPolicy(attempts=1)}
+    with pytest.raises(ProviderError):
+        await call_with_retries(call, **single)
+    assert kwargs["breaker"].state == "half_open"
+
+    # the next call gets to probe and closes the circuit
+    assert await call_with_retries(call, **kwargs) == "ok"
+    assert kwargs["breaker"].state == "closed"
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from apps.ai.engines import AIEngine, EngineCatalog
+from apps.ai.router import RollingHistogram
+from server.config import Settings
+
+
+def test_rolling_histogram():
+    histogram = RollingHistogram(window=60)
+    for _ in range(90):
+        histogram.observe(0.3)
+    for _ in range(10):
+        histogram.observe(5)
+    histogram.observe(1, ok=False)
+
+    assert histogram.count == 100
+    assert 0.25 < histogram.quantile(0.5) <= 0.5
+    assert 4 < histogram.quantile(0.95) <= 8
+    assert histogram.error_rate == pytest.approx(1 / 101)
+
+
+@pytest.fixture
+def catalog_file(tmp_path, monkeypatch):
+    catalog = EngineCatalog()
+    with open(Settings.AI_ENGINES_PATH) as f:
+        data = json.load(f)
+    path = tmp_path / "engines.json"
+    path.write_text(json.dumps(data))
+    monkeypatch.setattr(Settings, "AI_ENGINES_PATH", path)
+    yield path, data
+    monkeypatch.undo()
+    catalog.reload()
+
+
+@pytest.mark.asyncio
+async def test_catalog_reload(catalog_file, stub_env):
+    path, data = catalog_file
+    engine = AIEngine.get_by_name("gpt-4o-mini")
+    engine.limiter.latency.observe(0.5)
+    count = engine.limiter.latency.count
+
+    data["engines"]["gpt-4o-mini"]["input_price"] = 1
+    data["engines"]["gpt-4o"]["base_url"] = "https://other.example.com/v1"
+    path.write_text(json.dumps(data))
+    assert EngineCatalog().reload()
+
+    # price changes apply in place, connection changes build a new engine
+    assert AIEngine.get_by_name("gpt-4o-mini") is engine
+    assert engine.input_price == 1
+    assert engine.limiter.latency.count == count
+    assert AIEngine.get_by_name("gpt-4o").base_url == "https://other.example.com/v1"
+
+
+@pytest.mark.asyncio
+async def test_route_prefers_fast_then_cheap(catalog_file, stub_env):
+    path, data = catalog_file
+    data["routes"] = {
+        "stub_text": {
+            "models": ["gpt-4o", "gpt-4o-mini"],
+            "latency_weight": 1,
+            "cost_weight": 0,
+            "min_samples": 1,
+        }
+    }
+    path.write_text(json.dumps(data))
+    catalog = EngineCatalog()
+    catalog.reload()
+
+    slow, fast = AIEngine.get_by_name("gpt-4o-mini"), AIEngine.get_by_name("gpt-4o")
+    slow.limiter.latency = RollingHistogram()
+    fast.limiter.latency = RollingHistogram()
+    for _ in range(5):
+        slow.limiter.latency.observe(6)
+        fast.limiter.latency.observe(0.4)
+    assert catalog.route("stub_text", "gpt-4o-mini") == ["gpt-4o", "gpt-4o-mini"]
+
+    catalog.routes["stub_text"] |= {"latency_weight": 0, "cost_weight": 1}
+    assert catalog.route("stub_text", "gpt-4o-mini") == ["gpt-4o-mini", "gpt-4o"]
+    assert catalog.route("stub_vision", "gemini-2.0-flash") == ["gemini-2.0-flash"]
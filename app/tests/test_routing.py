@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from apps.ai.engines import AIEngine
+from apps.ai.retries import RetryPolicy
+from server.config import Settings
+
+
+@pytest.mark.asyncio
+async def test_hedged_request(
+    client: httpx.AsyncClient, settings: Settings, stub_env, monkeypatch
+):
+    monkeypatch.setattr(stub_env.app.state, "model_latency", {"gpt-4o-mini": 3.0})
+
+    start = time.perf_counter()
+    response = await client.post(
+        f"{settings.base_path}/ai/stub_hedged", json={"text": "hello"}
+    )
+    elapsed = time.perf_counter() - start
+
+    assert response.status_code == 200
+    result = response.json()
+    assert result["model"] == "gpt-4o"
+    assert elapsed < 2
+    # the cancelled gpt-4o-mini call is billed on top of the winner
+    assert result["coins"] > AIEngine.get_by_name("gpt-4o").get_price(100, 10)
+
+
+@pytest.mark.asyncio
+async def test_fallback_chain(
+    client: httpx.AsyncClient, settings: Settings, stub_env, monkeypatch
+):
+    engine = AIEngine.get_by_name("gemini-2.0-flash")
+    monkeypatch.setattr(engine, "_retry_policy", RetryPolicy(attempts=1))
+    monkeypatch.setattr(engine, "_breaker", None)
+    monkeypatch.setattr(stub_env.app.state, "failing_models", {"gemini-2.0-flash"})
+
+    response = await client.post(
+        f"{settings.base_path}/ai/stub_fallback", json={"text": "hello"}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["model"] == "gpt-4o-mini"
+
+
+@pytest.mark.asyncio
+async def test_hedged_cancels_primary_with_caller():
+    from apps.ai import routing
+
+    calls = []
+
+    async def call(model: str) -> dict:
+        try:
+            await asyncio.sleep(10)
+        finally:
+            calls.append(model)
+
+    request = asyncio.ensure_future(
+        routing.hedged(call, "slow", hedge_after=5, cancelled_cost=lambda m: 0)
+    )
+    await asyncio.sleep(0.05)
+    request.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await request
+    await asyncio.sleep(0)
+    assert calls == ["slow"]
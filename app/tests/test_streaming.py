@@ -0,0 +1,65 @@
+import json
+
+import httpx
+import pytest
+
+from server.config import Settings
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "path, payload",
+    [
+        ("stub_text", {"text": "stream me"}),
+        ("vision/stub_vision", {"image_urls": [], "data": {"summary": "stream"}}),
+    ],
+)
+async def test_sse_stream(
+    client: httpx.AsyncClient, settings: Settings, stub_env, path, payload
+):
+    async with client.stream(
+        "POST",
+        f"{settings.base_path}/ai/{path}",
+        json=payload,
+        headers={"Accept": "text/event-stream"},
+    ) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [
+            (block.split("\n")[0][7:], json.loads(block.split("\n")[1][6:]))
+            async for block in _sse_blocks(response)
+        ]
+
+    assert len(events) > 2
+    assert all(name == "delta" for name, _ in events[:-1])
+    name, done = events[-1]
+    assert name == "done"
+    assert done["ok"] is True
+    assert done["coins"] > 0
+    assert done["usage"] == {"input_tokens": 100, "output_tokens": 10}
+
+
+async def _sse_blocks(response: httpx.Response):
+    buffer = ""
+    async for text in response.aiter_text():
+        buffer += text
+        while "\n\n" in buffer:
+            block, buffer = buffer.split("\n\n", 1)
+            yield block
+
+
+@pytest.mark.asyncio
+async def test_stream_setup_errors_become_events(stub_env):
+    from apps.ai.prompts import PromptRegistry
+    from apps.ai.schemas import PromptTemplate
+    from apps.ai.services import stream_with_ai
+
+    registry = PromptRegistry()
+    registry.set(PromptTemplate(key="stub_stream_bad", model_name="no-such-model"))
+    try:
+        events = [event async for event in stream_with_ai("stub_stream_bad")]
+    finally:
+        registry.invalidate("stub_stream_bad")
+
+    assert [event["event"] for event in events] == ["error"]
+    assert "no-such-model" in events[0]["data"]["error"]
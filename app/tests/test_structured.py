@@ -0,0 +1,76 @@
+import httpx
+import pytest
+
+from apps.ai import services
+from apps.ai.schemas import PromptTemplate
+from server.config import Settings
+from tests.stubs import PROMPTS
+
+
+def test_response_schema_from_strapi():
+    template = PromptTemplate(**PROMPTS["stub_json"])
+    assert template.response_schema["properties"]["ok"] == {"type": "boolean"}
+    assert PromptTemplate(key="k", response_schema="").response_schema is None
+    # a malformed schema from Strapi drops the schema, not the prompt
+    assert PromptTemplate(key="k", response_schema="{oops").response_schema is None
+
+
+def test_extract_json():
+    assert services.extract_json('{"a": 1}', structured=True) == {"a": 1}
+    assert services.extract_json("[1, 2]", structured=True) == {"answer": [1, 2]}
+    # a provider ignoring the schema still gets the free text extraction
+    assert services.extract_json('Sure: {"a": 1}', structured=True) == {"a": 1}
+    assert services.parse_answer("plain answer", structured=True) == {
+        "answer": "plain answer"
+    }
+
+
+@pytest.mark.asyncio
+async def test_openai_structured_output(
+    client: httpx.AsyncClient, settings: Settings, stub_env
+):
+    response = await client.post(
+        f"{settings.base_path}/ai/stub_json", json={"text": "structured"}
+    )
+    assert response.status_code == 200
+    assert response.json()["ok"] is True
+
+    response_format = stub_env.app.state.response_format
+    assert response_format["type"] == "json_schema"
+    assert response_format["json_schema"]["schema"]["properties"]["ok"]
+    # the stub, like OpenAI, rejects strict mode for this open schema
+    assert response_format["json_schema"]["strict"] is False
+
+    closed = {
+        "type": "object",
+        "properties": {"ok": {"type": "boolean"}},
+        "required": ["ok"],
+        "additionalProperties": False,
+    }
+    assert services.strict_schema(closed)
+    messages = services.build_messages("system", "user", [], "gpt-4o-mini")
+    result = await services.answer_messages(
+        messages, 0, "gpt-4o-mini", response_schema=closed
+    )
+    assert result["ok"] is True
+    assert stub_env.app.state.response_format["json_schema"]["strict"] is True
+
+    # engines without the capability get no response_format
+    schema = PromptTemplate(**PROMPTS["stub_json"]).response_schema
+    messages = services.build_messages("system", "user", [], "grok-2")
+    await services.answer_messages(messages, 0, "grok-2", response_schema=schema)
+    assert stub_env.app.state.response_format is None
+
+
+@pytest.mark.asyncio
+async def test_gemini_structured_output(stub_env):
+    schema = PromptTemplate(**PROMPTS["stub_json"]).response_schema
+    messages = services.build_messages("system", "user", [], "gemini-2.0-flash")
+    result = await services.answer_messages(
+        messages, 0, "gemini-2.0-flash", response_schema=schema
+    )
+    assert result["ok"] is True
+
+    config = stub_env.app.state.generation_config
+    assert config["responseMimeType"] == "application/json"
+    assert config["responseJsonSchema"] == schema
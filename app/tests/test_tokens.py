@@ -0,0 +1,66 @@
+import httpx
+import pytest
+from fastapi_mongo_base.core import exceptions
+
+from apps.ai.engines import AIEngine
+from apps.ai.schemas import PromptTemplate
+from apps.ai.services import check_budget
+from apps.ai.tokens import Tokenizer
+from server.config import Settings
+
+
+def test_heuristic_tokenizer():
+    tokenizer = Tokenizer()
+    english, persian = "a" * 400, "سلام" * 100
+
+    assert tokenizer.count(english) == 100
+    # two UTF-8 bytes a letter, so Persian counts twice as many tokens
+    assert tokenizer.count(persian) == 200
+    truncated = tokenizer.truncate(persian + english, 150)
+    assert tokenizer.count(truncated) <= 150
+    assert persian.startswith(truncated)
+
+
+def test_unavailable_encoding_falls_back(monkeypatch):
+    tiktoken = pytest.importorskip("tiktoken")
+
+    def offline(name):
+        raise OSError("no network")
+
+    monkeypatch.setattr(tiktoken, "get_encoding", offline)
+    tokenizer = Tokenizer("o200k_base")
+    assert tokenizer.name == "heuristic"
+    assert tokenizer.count("a" * 400) == 100
+
+
+def test_truncate_to_input_budget(monkeypatch):
+    monkeypatch.setattr(Settings, "AI_MAX_INPUT_TOKENS", 1000)
+    engine = AIEngine.get_by_name("gemini-2.0-flash")
+    user = engine.truncate("s" * 400, "u" * 40000)
+    assert engine.tokenizer.count(user) == 900
+
+
+def test_check_budget():
+    template = PromptTemplate(
+        key="budget", user="{text}", model_name="gpt-4o", max_coins=0.1
+    )
+    assert check_budget(template, "", "hi", 0, "gpt-4o-mini") == "gpt-4o-mini"
+    with pytest.raises(exceptions.BaseHTTPException) as e:
+        check_budget(template, "", "hi", 0, "gpt-4o")
+    assert e.value.status_code == 402
+
+    template.over_budget, template.downgrade_model = "downgrade", "gpt-4o-mini"
+    assert check_budget(template, "", "hi", 0, "gpt-4o") == "gpt-4o-mini"
+    with pytest.raises(exceptions.BaseHTTPException):
+        check_budget(template, "", "hi", 10, "gpt-4o")
+
+
+@pytest.mark.asyncio
+async def test_budget_downgrade(
+    client: httpx.AsyncClient, settings: Settings, stub_env
+):
+    response = await client.post(
+        f"{settings.base_path}/ai/stub_budget", json={"text": "hello"}
+    )
+    assert response.status_code == 200
+    assert response.json()["model"] == "gpt-4o-mini"
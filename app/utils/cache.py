@@ -0,0 +1,217 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+import aiofiles
+
+
+def content_hash(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        elif not isinstance(part, (bytes, bytearray, memoryview)):
+            part = json.dumps(part, sort_keys=True, ensure_ascii=False, default=str)
+            part = part.encode()
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+
+def sizeof(value) -> int:
+    """Approximate payload size of a cached value in bytes."""
+
+    if isinstance(value, (bytes, bytearray, memoryview, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(sizeof(v) for v in value)
+    return 8
+
+
+def _encode_bytes(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"__bytes__": base64.b64encode(value).decode()}
+    raise TypeError(f"{type(value)} is not JSON serializable")
+
+
+def _decode_bytes(value: dict):
+    if "__bytes__" in value:
+        return base64.b64decode(value["__bytes__"])
+    return value
+
+
+class LRUCache:
+    """In-memory LRU cache bounded by the total size of its values in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries: OrderedDict[str, tuple[float, Any, int]] = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.time():
+            if entry is not None:
+                self.pop(key)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, value, ttl: float, size: int):
+        if size > self.max_bytes:
+            return
+        self.pop(key)
+        self.entries[key] = (time.time() + ttl, value, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, _, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def pop(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+        return entry
+
+
+class DiskCache:
+    """
+    JSON files under `directory`, one per key, sharded by the key prefix.
+
+    Each file's mtime is set to its expiry. At most every `sweep_interval`
+    seconds a write starts a sweep, which deletes the expired files and then,
+    while the directory exceeds `max_bytes`, the files closest to expiring.
+    """
+
+    def __init__(
+        self,
+        directory: Path | str,
+        max_bytes: int | None = None,
+        sweep_interval: float = 600,
+    ):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.swept_at = 0.0
+        self.sweeping: asyncio.Task | None = None
+
+    def path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    async def get(self, key: str) -> tuple[Any, float] | None:
+        path = self.path(key)
+        try:
+            async with aiofiles.open(path) as f:
+                entry: dict = json.loads(await f.read(), object_hook=_decode_bytes)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read disk cache {path}: {e}")
+            return None
+
+        expires_at = entry.get("expires_at", 0)
+        if expires_at < time.time():
+            path.unlink(missing_ok=True)
+            return None
+        return entry.get("value"), expires_at
+
+    async def set(self, key: str, value, ttl: float):
+        path = self.path(key)
+        # other processes may share the directory
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        expires_at = time.time() + ttl
+        entry = {"expires_at": expires_at, "value": value}
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            async with aiofiles.open(tmp_path, "w") as f:
+                await f.write(
+                    json.dumps(entry, ensure_ascii=False, default=_encode_bytes)
+                )
+            os.utime(tmp_path, (expires_at, expires_at))
+            tmp_path.replace(path)
+        except OSError as e:
+            logging.warning(f"Could not write disk cache {path}: {e}")
+            tmp_path.unlink(missing_ok=True)
+
+        if time.monotonic() - self.swept_at > self.sweep_interval and not (
+            self.sweeping and not self.sweeping.done()
+        ):
+            self.swept_at = time.monotonic()
+            self.sweeping = asyncio.create_task(asyncio.to_thread(self.sweep))
+
+    def sweep(self) -> int:
+        """Delete expired and, beyond `max_bytes`, soonest expiring files."""
+
+        now, removed, files = time.time(), 0, []
+        try:
+            for path in self.directory.glob("*/*"):
+                stat = path.stat()
+                if path.suffix == ".tmp":
+                    # left behind by a writer that died
+                    expired = stat.st_mtime < now - self.sweep_interval
+                else:
+                    expired = stat.st_mtime < now
+                if expired:
+                    path.unlink(missing_ok=True)
+                    removed += 1
+                elif path.suffix == ".json":
+                    files.append((stat.st_mtime, stat.st_size, path))
+
+            size = sum(file_size for _, file_size, _ in files)
+            for _, file_size, path in sorted(files):
+                if not self.max_bytes or size <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                size -= file_size
+                removed += 1
+        except OSError as e:
+            logging.warning(f"Could not sweep disk cache {self.directory}: {e}")
+        return removed
+
+
+class TieredCache:
+    """Memory LRU in front of an optional disk tier for JSON-like values and bytes."""
+
+    def __init__(
+        self,
+        max_bytes: int,
+        directory: Path | str | None = None,
+        disk_max_bytes: int | None = None,
+    ):
+        self.memory = LRUCache(max_bytes)
+        self.disk = DiskCache(directory, disk_max_bytes) if directory else None
+
+    async def get(self, key: str):
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return value
+
+        entry = await self.disk.get(key)
+        if entry is None:
+            return None
+
+        value, expires_at = entry
+        self.memory.set(key, value, ttl=expires_at - time.time(), size=sizeof(value))
+        return value
+
+    async def set(self, key: str, value, ttl: float):
+        self.memory.set(key, value, ttl=ttl, size=sizeof(value))
+        if self.disk is not None:
+            await self.disk.set(key, value, ttl)
@@ -0,0 +1,124 @@
+import re
+
+from fastapi_mongo_base.core.enums import Language
+
+ISO_CODES = {
+    "en": Language.English,
+    "fa": Language.Persian,
+    "ar": Language.Arabic,
+    "tr": Language.Turkish,
+    "fr": Language.French,
+    "es": Language.Spanish,
+    "de": Language.German,
+    "it": Language.Italian,
+    "pt": Language.Portuguese,
+    "nl": Language.Dutch,
+    "ru": Language.Russian,
+    "pl": Language.Polish,
+    "ro": Language.Romanian,
+    "bg": Language.Bulgarian,
+    "hu": Language.Hungarian,
+    "cs": Language.Czech,
+    "el": Language.Greek,
+    "he": Language.Hebrew,
+    "ja": Language.Japanese,
+    "ko": Language.Korean,
+    "vi": Language.Vietnamese,
+    "id": Language.Indonesian,
+}
+
+SCRIPTS = {
+    "arabic": re.compile("[\u0600-\u06ff\u0750-\u077f\ufb50-\ufdff\ufe70-\ufeff]"),
+    "hebrew": re.compile("[\u0590-\u05ff]"),
+    "greek": re.compile("[\u0370-\u03ff]"),
+    "cyrillic": re.compile("[\u0400-\u04ff]"),
+    "kana": re.compile("[\u3040-\u30ff]"),
+    "hangul": re.compile("[\uac00-\ud7af\u1100-\u11ff]"),
+    "latin": re.compile("[A-Za-z\u00c0-\u024f\u1e00-\u1eff]"),
+}
+# letters only Persian uses, and the Arabic forms Persian writes differently
+PERSIAN_LETTERS = re.compile("[\u067e\u0686\u0698\u06af\u06a9\u06cc]")  # پ چ ژ گ ک ی
+ARABIC_LETTERS = re.compile("[\u0629\u064a\u0643\u0649]")  # ة ي ك ى
+
+STOPWORDS = {
+    Language.English: "the and of to is in that it for with as on are this you",
+    Language.French: "le la les des et est une que pour dans du qui pas sur",
+    Language.Spanish: "el la los las que de y es en un una por para con del",
+    Language.German: "der die das und ist nicht ein eine zu mit den von auf ich",
+    Language.Italian: "il la che di e un una per non sono con del gli della",
+    Language.Portuguese: "o a os as que de e um uma para com não do da em",
+    Language.Dutch: "de het een en van is dat niet op te zijn met voor",
+    Language.Polish: "i w nie na się z do jest to że jak dla po",
+    Language.Romanian: "și în de la cu un o nu este pe care din pentru",
+    Language.Hungarian: "a az és hogy nem is egy van de meg ez",
+    Language.Czech: "a je to na se v že s z do jsem není",
+    Language.Turkish: "ve bir bu da de için ile çok ne var mı gibi",
+    Language.Vietnamese: "và của là có không được cho một những người này",
+    Language.Indonesian: "dan yang di ini itu dengan untuk tidak dari ada ke",
+}
+STOPWORDS = {language: set(words.split()) for language, words in STOPWORDS.items()}
+WORD = re.compile(r"[^\W\d_]+")
+
+
+def from_code(code: str | None) -> Language | None:
+    if not code:
+        return None
+    return ISO_CODES.get(code.split("-")[0].lower())
+
+
+def detect_script(text: str) -> str | None:
+    counts = {script: len(pattern.findall(text)) for script, pattern in SCRIPTS.items()}
+    script, count = max(counts.items(), key=lambda item: item[1])
+    return script if count else None
+
+
+def detect_latin(text: str) -> Language | None:
+    words = WORD.findall(text.lower())
+    scores = {
+        language: sum(word in stopwords for word in words)
+        for language, stopwords in STOPWORDS.items()
+    }
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    (best, best_score), (_, second_score) = ranked[0], ranked[1]
+    if best_score >= 2 and best_score >= 1.5 * second_score:
+        return best
+    return None
+
+
+def detect_statistical(text: str) -> Language | None:
+    import langdetect
+
+    # seeded so the same text always gets the same answer
+    langdetect.DetectorFactory.seed = 0
+    try:
+        return from_code(langdetect.detect(text))
+    except langdetect.LangDetectException:
+        return None
+
+
+def detect_language(text: str) -> Language | None:
+    """
+    Classify by Unicode script first, which settles Persian/Arabic and the
+    non-Latin languages without a model. Latin text is scored on stopwords and
+    only ambiguous inputs fall back to seeded langdetect.
+    """
+
+    script = detect_script(text)
+    if script == "arabic":
+        persian = len(PERSIAN_LETTERS.findall(text))
+        arabic = len(ARABIC_LETTERS.findall(text))
+        return Language.Arabic if arabic > persian else Language.Persian
+    if script == "cyrillic":
+        if "\u044a" in text and not re.search("[\u044b\u044d]", text):  # ъ, ы э
+            return Language.Bulgarian
+        return Language.Russian
+    if script in ("hebrew", "greek", "kana", "hangul"):
+        return {
+            "hebrew": Language.Hebrew,
+            "greek": Language.Greek,
+            "kana": Language.Japanese,
+            "hangul": Language.Korean,
+        }[script]
+    if script == "latin":
+        return detect_latin(text) or detect_statistical(text)
+    return None
@@ -36,3 +36,30 @@ async def get_prompt(key, raise_exception=True) -> dict:
         raise exceptions.BaseHTTPException(
             status_code=404, error="key_not_found", message=f"Key {key} not found"
         )
+
+
+async def get_prompt_page(
+    page: int = 1, page_size: int = 100, updated_after: str | None = None
+) -> dict:
+    params = {"pagination[page]": page, "pagination[pageSize]": page_size}
+    if updated_after:
+        params["filters[updatedAt][$gt]"] = updated_after
+
+    headers = {"Authorization": f"Bearer {Settings.STRAPI_TOKEN}"}
+    return await aionetwork.aio_request(
+        url=Settings.STRAPI_URL, headers=headers, params=params
+    )
+
+
+async def get_all_prompts(
+    page_size: int = 100, updated_after: str | None = None
+) -> list[dict]:
+    prompts = []
+    page, page_count = 1, 1
+    while page <= page_count:
+        res = await get_prompt_page(page, page_size, updated_after)
+        prompts += [d.get("attributes", {}) for d in res.get("data", [])]
+        pagination: dict = res.get("meta", {}).get("pagination", {})
+        page_count = pagination.get("pageCount", page)
+        page += 1
+    return prompts
@@ -0,0 +1,42 @@
+import asyncio
+from typing import Awaitable, Callable
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into one execution.
+
+    The first caller starts the work as a task, later callers await the same
+    task. Cancelling one caller leaves the work running for the others; once
+    the last caller has cancelled, the work is cancelled too.
+    """
+
+    def __init__(self):
+        self.calls: dict[str, asyncio.Task] = {}
+        self.waiters: dict[asyncio.Task, int] = {}
+
+    def __len__(self):
+        return len(self.calls)
+
+    def forget(self, key: str, task: asyncio.Task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+
+    async def do(self, key: str, func: Callable[..., Awaitable], *args, **kwargs):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self.calls[key] = task
+            task.add_done_callback(lambda _: self.forget(key, task))
+
+        self.waiters[task] = self.waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self.waiters[task] -= 1
+            if not self.waiters[task]:
+                del self.waiters[task]
+                if not task.done():
+                    # nobody is left to use the result
+                    self.forget(key, task)
+                    task.cancel()
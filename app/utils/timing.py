@@ -0,0 +1,110 @@
+import contextvars
+import functools
+import importlib.util
+import random
+import time
+from contextlib import contextmanager, nullcontext
+
+from server.config import Settings
+
+
+class Timings:
+    """
+    Stage durations of one request, reported in the Server-Timing header.
+
+    Stages that run more than once, like concurrent image downloads or retried
+    provider calls, add up, so their sum can exceed the request's total. Work
+    coalesced across requests is charged in full to each of them.
+    """
+
+    def __init__(self, sampled: bool = False):
+        self.start = time.perf_counter()
+        self.sampled = sampled
+        self.stages: dict[str, float] = {}
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0) + seconds
+
+    def header(self) -> str:
+        stages = self.stages | {"total": time.perf_counter() - self.start}
+        return ", ".join(
+            f"{name};dur={seconds * 1000:0.1f}" for name, seconds in stages.items()
+        )
+
+
+timings: contextvars.ContextVar[Timings | None] = contextvars.ContextVar(
+    "timings", default=None
+)
+
+
+async def timed(func, *args, **kwargs) -> tuple[object, dict[str, float]]:
+    """Run `func` with its own timings, returning its result and stages."""
+
+    current = timings.get()
+    token = timings.set(Timings(sampled=current is not None and current.sampled))
+    try:
+        result = await func(*args, **kwargs)
+        return result, timings.get().stages
+    finally:
+        timings.reset(token)
+
+
+def add_stages(stages: dict[str, float]):
+    current = timings.get()
+    if current is not None:
+        for name, seconds in stages.items():
+            current.add(name, seconds)
+
+
+@functools.lru_cache
+def get_tracer():
+    if importlib.util.find_spec("opentelemetry") is None:
+        return None
+
+    from opentelemetry import trace
+
+    return trace.get_tracer("promptly")
+
+
+def span(name: str, **attributes):
+    """An OpenTelemetry span when the request is sampled and OTel is installed."""
+
+    current = timings.get()
+    tracer = get_tracer() if current and current.sampled else None
+    if tracer is None:
+        return nullcontext()
+    attributes = {k: v for k, v in attributes.items() if v is not None}
+    return tracer.start_as_current_span(f"promptly.{name}", attributes=attributes)
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Time a stage of the current request and trace it when sampled."""
+
+    current = timings.get()
+    start = time.perf_counter()
+    with span(name, **attributes):
+        try:
+            yield
+        finally:
+            if current is not None:
+                current.add(name, time.perf_counter() - start)
+
+
+async def server_timing(request, call_next):
+    """Time the stages of each request and report them in a Server-Timing header."""
+
+    sampled = random.random() < Settings.TRACE_SAMPLE_RATE
+    if not Settings.SERVER_TIMING and not sampled:
+        return await call_next(request)
+
+    current = Timings(sampled=sampled)
+    token = timings.set(current)
+    try:
+        with span("request", method=request.method, path=request.url.path):
+            response = await call_next(request)
+    finally:
+        timings.reset(token)
+    if Settings.SERVER_TIMING:
+        response.headers["Server-Timing"] = current.header()
+    return response